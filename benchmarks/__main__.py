@@ -0,0 +1,257 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Command line entry point.
+
+python -m benchmarks run --sizes 1000,10000 --output results.json
+python -m benchmarks run --dsn pg=postgresql+asyncpg://localhost/bench
+python -m benchmarks compare base.json results.json --threshold 0.1
+python -m benchmarks memory --sizes 100000
+python -m benchmarks calls --calls 2000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+from .datasets import DATASETS
+from .runner import bench_adapter, bench_calls, bench_memory, environment
+
+
+def parse_targets(args, tmpdir):
+    targets = {}
+    if not args.no_sqlite:
+        targets["sqlite-file"] = "sqlite+aiosqlite:///" + os.path.join(
+            tmpdir, "bench.db"
+        )
+        targets["sqlite-memory"] = "sqlite+aiosqlite://"
+    for dsn in args.dsn:
+        name, sep, url = dsn.partition("=")
+        if not sep:
+            name, url = "dsn{}".format(len(targets)), dsn
+        targets[name] = url
+    return targets
+
+
+async def run(args):
+    report = {"environment": environment(), "results": []}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for target, dsn in parse_targets(args, tmpdir).items():
+            for dataset in args.datasets.split(","):
+                for size in (int(s) for s in args.sizes.split(",")):
+                    print("{} {} {}".format(target, dataset, size), file=sys.stderr)
+                    results = await bench_adapter(
+                        dsn, dataset, size, args.repeat, args.batch_size, args.seed
+                    )
+                    for result in results:
+                        result["target"] = target
+                        print(
+                            "  {:<22} p50 {:>10.2f} ms  {:>12.0f} rows/s".format(
+                                result["method"],
+                                result["latency_ms"]["p50"],
+                                result["throughput_rows_per_s"] or 0,
+                            ),
+                            file=sys.stderr,
+                        )
+                    report["results"].extend(results)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+async def memory(args):
+    """prints the memory a loaded model retains with and without intern_values."""
+    report = {"environment": environment(), "results": []}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for target, dsn in parse_targets(args, tmpdir).items():
+            for dataset in args.datasets.split(","):
+                for size in (int(s) for s in args.sizes.split(",")):
+                    results = await bench_memory(
+                        dsn, dataset, size, args.batch_size, args.seed
+                    )
+                    default, interned = results
+                    saved = 1 - interned["retained_bytes"] / default["retained_bytes"]
+                    print(
+                        "{} {} {}: {:.1f} MiB -> {:.1f} MiB retained ({:.0%} less)".format(
+                            target,
+                            dataset,
+                            size,
+                            default["retained_bytes"] / 2**20,
+                            interned["retained_bytes"] / 2**20,
+                            saved,
+                        ),
+                        file=sys.stderr,
+                    )
+                    for result in results:
+                        result["target"] = target
+                    report["results"].extend(results)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+async def calls(args):
+    """prints the per-call latency of the single-rule methods with and without the statement cache."""
+    report = {"environment": environment(), "results": []}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for target, dsn in parse_targets(args, tmpdir).items():
+            results = await bench_calls(dsn, args.calls, args.size, args.seed)
+            for result in results:
+                result["target"] = target
+                print(
+                    "{:<14} {:<22} {:<8} p50 {:>8.1f} us  mean {:>8.1f} us".format(
+                        target,
+                        result["method"],
+                        result["mode"],
+                        result["per_call_us"]["p50"],
+                        result["per_call_us"]["mean"],
+                    ),
+                    file=sys.stderr,
+                )
+            report["results"].extend(results)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+def compare(args):
+    """prints the p50 change per benchmark and fails when one regressed past the threshold."""
+
+    def index(path):
+        with open(path) as f:
+            results = json.load(f)["results"]
+        return {(r["target"], r["dataset"], r["size"], r["method"]): r for r in results}
+
+    base, head = index(args.base), index(args.head)
+    regressed = False
+    for key in sorted(base.keys() & head.keys()):
+        before = base[key]["latency_ms"]["p50"]
+        after = head[key]["latency_ms"]["p50"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(
+            "{:<14} {:<5} {:>8} {:<22} {:>10.2f} -> {:>10.2f} ms {:+7.1%}{}".format(
+                *key, before, after, change, flag
+            )
+        )
+    return 1 if regressed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and emit JSON")
+    run_parser.add_argument(
+        "--sizes", default="1000,10000,100000", help="comma separated rule counts"
+    )
+    run_parser.add_argument(
+        "--datasets", default=",".join(DATASETS), help="comma separated datasets"
+    )
+    run_parser.add_argument(
+        "--repeat", type=int, default=5, help="timed runs per method"
+    )
+    run_parser.add_argument(
+        "--batch-size", type=int, default=1000, help="Adapter batch_size"
+    )
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument(
+        "--dsn", action="append", default=[], help="extra target, [name=]url"
+    )
+    run_parser.add_argument(
+        "--no-sqlite", action="store_true", help="skip the SQLite targets"
+    )
+    run_parser.add_argument(
+        "--output", help="write the JSON report here instead of stdout"
+    )
+
+    memory_parser = commands.add_parser(
+        "memory", help="compare load_policy memory with and without interning"
+    )
+    memory_parser.add_argument(
+        "--sizes", default="100000", help="comma separated rule counts"
+    )
+    memory_parser.add_argument(
+        "--datasets", default=",".join(DATASETS), help="comma separated datasets"
+    )
+    memory_parser.add_argument(
+        "--batch-size", type=int, default=1000, help="Adapter batch_size"
+    )
+    memory_parser.add_argument("--seed", type=int, default=0)
+    memory_parser.add_argument(
+        "--dsn", action="append", default=[], help="extra target, [name=]url"
+    )
+    memory_parser.add_argument(
+        "--no-sqlite", action="store_true", help="skip the SQLite targets"
+    )
+    memory_parser.add_argument(
+        "--output", help="write the JSON report here instead of stdout"
+    )
+
+    calls_parser = commands.add_parser(
+        "calls", help="time single-rule calls with and without the statement cache"
+    )
+    calls_parser.add_argument(
+        "--calls", type=int, default=1000, help="timed calls per method"
+    )
+    calls_parser.add_argument(
+        "--size", type=int, default=1000, help="rules in the table"
+    )
+    calls_parser.add_argument("--seed", type=int, default=0)
+    calls_parser.add_argument(
+        "--dsn", action="append", default=[], help="extra target, [name=]url"
+    )
+    calls_parser.add_argument(
+        "--no-sqlite", action="store_true", help="skip the SQLite targets"
+    )
+    calls_parser.add_argument(
+        "--output", help="write the JSON report here instead of stdout"
+    )
+
+    compare_parser = commands.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="allowed p50 slowdown"
+    )
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        return asyncio.run(run(args))
+    if args.command == "memory":
+        return asyncio.run(memory(args))
+    if args.command == "calls":
+        return asyncio.run(calls(args))
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Synthetic policy sets, generated deterministically from a seed."""
+
+import random
+
+from casbin import model as casbin_model
+
+RBAC_MODEL = """
+[request_definition]
+r = sub, dom, obj, act
+
+[policy_definition]
+p = sub, dom, obj, act
+
+[role_definition]
+g = _, _, _
+
+[policy_effect]
+e = some(where (p.eft == allow))
+
+[matchers]
+m = g(r.sub, p.sub, r.dom) && r.dom == p.dom && r.obj == p.obj && r.act == p.act
+"""
+
+ABAC_MODEL = """
+[request_definition]
+r = sub, obj, act
+
+[policy_definition]
+p = sub_rule, obj, act
+
+[policy_effect]
+e = some(where (p.eft == allow))
+
+[matchers]
+m = eval(p.sub_rule) && r.obj == p.obj && r.act == p.act
+"""
+
+ACTIONS = ("read", "write", "delete", "list")
+
+
+def rbac(size, seed=0):
+    """returns (ptype, rule) pairs for RBAC with domains, about one grouping rule per four.
+
+    The domain is v1 of every p rule, which is what the filtered-load benchmark
+    selects on.
+    """
+    rnd = random.Random(seed)
+    domains = max(1, size // 1000)
+    roles = max(1, size // 100)
+    rules = []
+    for i in range(size):
+        domain = "domain{}".format(rnd.randrange(domains))
+        if i % 4 == 3:
+            rules.append(
+                (
+                    "g",
+                    ["user{}".format(i), "role{}".format(rnd.randrange(roles)), domain],
+                )
+            )
+        else:
+            rules.append(
+                (
+                    "p",
+                    [
+                        "role{}".format(rnd.randrange(roles)),
+                        domain,
+                        "/resource/{}/{}".format(rnd.randrange(size), i),
+                        rnd.choice(ACTIONS),
+                    ],
+                )
+            )
+    return rules
+
+
+def abac(size, seed=0):
+    """returns (ptype, rule) pairs for ABAC, every rule carries an eval() condition."""
+    rnd = random.Random(seed)
+    rules = []
+    for i in range(size):
+        condition = "r.sub.Age > {} && r.sub.Dept == 'dept{}'".format(
+            rnd.randrange(18, 65), rnd.randrange(50)
+        )
+        rules.append(("p", [condition, "/object/{}".format(i), rnd.choice(ACTIONS)]))
+    return rules
+
+
+DATASETS = {
+    "rbac": (RBAC_MODEL, rbac),
+    "abac": (ABAC_MODEL, abac),
+}
+
+
+def new_model(dataset):
+    m = casbin_model.Model()
+    m.load_model_from_text(DATASETS[dataset][0])
+    return m
+
+
+def generate(dataset, size, seed=0):
+    return DATASETS[dataset][1](size, seed)
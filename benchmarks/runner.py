@@ -0,0 +1,319 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Times the adapter methods against one database and policy set."""
+
+import math
+import platform
+import time
+import tracemalloc
+import warnings
+from datetime import datetime, timezone
+
+import casbin
+import sqlalchemy
+from sqlalchemy import Column, Integer, String, delete
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import declarative_base
+
+from casbin_async_sqlalchemy_adapter import Adapter
+from casbin_async_sqlalchemy_adapter.adapter import Filter
+
+from .datasets import generate, new_model
+
+BenchBase = declarative_base()
+
+
+class BenchRule(BenchBase):
+    """a dedicated table, so running against a real DSN never touches casbin_rule."""
+
+    __tablename__ = "casbin_rule_bench"
+
+    id = Column(Integer, primary_key=True)
+    ptype = Column(String(255))
+    v0 = Column(String(255))
+    v1 = Column(String(255))
+    v2 = Column(String(255))
+    v3 = Column(String(255))
+    v4 = Column(String(255))
+    v5 = Column(String(255))
+
+
+def percentile(values, q):
+    """nearest-rank percentile of an unsorted list."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(method, rows, latencies, peak_memory):
+    median = percentile(latencies, 50)
+    return {
+        "method": method,
+        "rows": rows,
+        "runs": len(latencies),
+        "latency_ms": {
+            "min": min(latencies) * 1000,
+            "p50": median * 1000,
+            "p90": percentile(latencies, 90) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "max": max(latencies) * 1000,
+            "mean": sum(latencies) / len(latencies) * 1000,
+        },
+        "throughput_rows_per_s": rows / median if median > 0 else None,
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+async def measure(method, rows, run, repeat, setup=None, teardown=None):
+    """times run() repeat times, then once more under tracemalloc for the peak memory."""
+    latencies = []
+    for _ in range(repeat):
+        if setup is not None:
+            await setup()
+        start = time.perf_counter()
+        await run()
+        latencies.append(time.perf_counter() - start)
+        if teardown is not None:
+            await teardown()
+
+    if setup is not None:
+        await setup()
+    tracemalloc.start()
+    try:
+        await run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    if teardown is not None:
+        await teardown()
+    return summarize(method, rows, latencies, peak_memory)
+
+
+def group_by_ptype(ptype_rules):
+    groups = {}
+    for ptype, rule in ptype_rules:
+        groups.setdefault(ptype, []).append(rule)
+    return groups
+
+
+async def bench_adapter(dsn, dataset, size, repeat=5, batch_size=1000, seed=0):
+    """runs every adapter benchmark for one policy set and returns the result records."""
+    ptype_rules = generate(dataset, size, seed)
+    groups = group_by_ptype(ptype_rules)
+    engine = create_async_engine(dsn, future=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        adapter = Adapter(engine, db_class=BenchRule, batch_size=batch_size)
+    async with engine.begin() as conn:
+        await conn.run_sync(BenchBase.metadata.drop_all)
+        await conn.run_sync(BenchBase.metadata.create_all)
+
+    async def clear_table():
+        async with adapter._session_scope() as session:
+            await session.execute(delete(BenchRule))
+
+    async def add_all():
+        for ptype, rules in groups.items():
+            await adapter.add_policies(ptype[0], ptype, rules)
+
+    results = []
+    try:
+        results.append(
+            await measure("add_policies", size, add_all, repeat, setup=clear_table)
+        )
+
+        async def load_all():
+            await adapter.load_policy(new_model(dataset))
+
+        results.append(await measure("load_policy", size, load_all, repeat))
+
+        p_rules = groups.get("p", [])
+        domains = sorted({rule[1] for rule in p_rules})
+        filter = Filter()
+        filter.v1 = domains[: max(1, len(domains) // 10)]
+        selected = set(filter.v1)
+        filtered_rows = sum(1 for _, rule in ptype_rules if rule[1] in selected)
+
+        async def load_filtered():
+            await adapter.load_filtered_policy(new_model(dataset), filter)
+
+        results.append(
+            await measure("load_filtered_policy", filtered_rows, load_filtered, repeat)
+        )
+
+        changed = p_rules[: max(1, min(len(p_rules) // 10, 10000))]
+        renamed = [rule[:-1] + [rule[-1] + "_updated"] for rule in changed]
+        state = {"current": changed, "next": renamed}
+
+        async def update_batch():
+            await adapter.update_policies("p", "p", state["current"], state["next"])
+            state["current"], state["next"] = state["next"], state["current"]
+
+        results.append(
+            await measure("update_policies", len(changed), update_batch, repeat)
+        )
+
+        async def remove_batch():
+            await adapter.remove_policies("p", "p", state["current"])
+
+        async def restore_batch():
+            await adapter.add_policies("p", "p", state["current"])
+
+        results.append(
+            await measure(
+                "remove_policies",
+                len(changed),
+                remove_batch,
+                repeat,
+                teardown=restore_batch,
+            )
+        )
+
+        saved_model = new_model(dataset)
+        await adapter.load_policy(saved_model)
+
+        async def save_all():
+            await adapter.save_policy(saved_model)
+
+        results.append(await measure("save_policy", size, save_all, repeat))
+    finally:
+        async with engine.begin() as conn:
+            await conn.run_sync(BenchBase.metadata.drop_all)
+        await engine.dispose()
+
+    for result in results:
+        result.update({"dataset": dataset, "size": size})
+    return results
+
+
+async def bench_memory(dsn, dataset, size, batch_size=1000, seed=0):
+    """compares the memory a loaded model retains with and without intern_values."""
+    engine = create_async_engine(dsn, future=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        adapter = Adapter(engine, db_class=BenchRule, batch_size=batch_size)
+    async with engine.begin() as conn:
+        await conn.run_sync(BenchBase.metadata.drop_all)
+        await conn.run_sync(BenchBase.metadata.create_all)
+
+    results = []
+    try:
+        async with adapter._session_scope() as session:
+            await adapter._insert_rules(session, generate(dataset, size, seed))
+        for mode, intern_values in (("default", False), ("interned", True)):
+            adapter._intern_values = intern_values
+            # a warm-up load, so the engine's caches are not counted
+            await adapter.load_policy(new_model(dataset))
+            model = new_model(dataset)
+            tracemalloc.start()
+            try:
+                await adapter.load_policy(model)
+                retained, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            results.append(
+                {
+                    "method": "load_policy",
+                    "mode": mode,
+                    "dataset": dataset,
+                    "size": size,
+                    "retained_bytes": retained,
+                    "peak_memory_bytes": peak,
+                }
+            )
+            del model
+    finally:
+        async with engine.begin() as conn:
+            await conn.run_sync(BenchBase.metadata.drop_all)
+        await engine.dispose()
+    return results
+
+
+async def bench_calls(dsn, calls=1000, size=1000, seed=0):
+    """times single-rule calls with and without the adapter's statement cache.
+
+    The uncached mode rebuilds every statement on each call, as the per-rule
+    methods did before they kept bindparam statements per shape.
+    """
+    engine = create_async_engine(dsn, future=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        adapter = Adapter(engine, db_class=BenchRule)
+    async with engine.begin() as conn:
+        await conn.run_sync(BenchBase.metadata.drop_all)
+        await conn.run_sync(BenchBase.metadata.create_all)
+
+    rules = [rule for ptype, rule in generate("rbac", size, seed) if ptype == "p"]
+    old_rule = rules[0]
+    new_rule = old_rule[:-1] + [old_rule[-1] + "_updated"]
+    state = {"current": old_rule, "next": new_rule}
+
+    async def update_one():
+        await adapter.update_policy("p", "p", state["current"], state["next"])
+        state["current"], state["next"] = state["next"], state["current"]
+
+    async def remove_missing():
+        await adapter.remove_policy("p", "p", ["nobody", "nowhere", "/none", "read"])
+
+    async def remove_filtered_missing():
+        await adapter.remove_filtered_policy("p", "p", 1, "nowhere")
+
+    methods = (
+        ("update_policy", update_one),
+        ("remove_policy", remove_missing),
+        ("remove_filtered_policy", remove_filtered_missing),
+    )
+    cached = adapter._cached
+    results = []
+    try:
+        await adapter.add_policies("p", "p", rules)
+        for mode in ("uncached", "cached"):
+            if mode == "uncached":
+                adapter._cached = lambda key, build: build()
+            else:
+                adapter._cached = cached
+            for method, call in methods:
+                await call()
+                latencies = []
+                for _ in range(calls):
+                    start = time.perf_counter()
+                    await call()
+                    latencies.append(time.perf_counter() - start)
+                results.append(
+                    {
+                        "method": method,
+                        "mode": mode,
+                        "calls": calls,
+                        "per_call_us": {
+                            "p50": percentile(latencies, 50) * 1e6,
+                            "p90": percentile(latencies, 90) * 1e6,
+                            "mean": sum(latencies) / len(latencies) * 1e6,
+                        },
+                    }
+                )
+    finally:
+        async with engine.begin() as conn:
+            await conn.run_sync(BenchBase.metadata.drop_all)
+        await engine.dispose()
+    return results
+
+
+def environment():
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "casbin": getattr(casbin, "__version__", None),
+    }
@@ -12,4 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .adapter import CasbinRule, Adapter, Base
+from .adapter import CasbinRule, CasbinRuleLog, Adapter, Base
+from .cache import PolicyCache
+from .engine import EngineOptions
+from .write_behind import WriteBehindQueue
+from .sharded import FieldRouter, ShardedAdapter
+from .snapshot import PolicySnapshot, write_snapshot
+from .instrumentation import (
+    AdapterObserver,
+    OperationEvent,
+    OpenTelemetryObserver,
+    PrometheusObserver,
+)
+from .watcher import (
+    ChangeEvent,
+    ChangePublisher,
+    PostgresNotifyListener,
+    PostgresNotifyPublisher,
+    TableChangeListener,
+)
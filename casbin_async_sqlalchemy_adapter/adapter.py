@@ -11,23 +11,74 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
+import contextvars
+import logging
+import time
 import warnings
+from collections import Counter
 from contextlib import asynccontextmanager
 from typing import List
 
-from casbin import persist
 from casbin.persist.adapters.asyncio import AsyncAdapter
-from sqlalchemy import Column, Integer, String, delete
-from sqlalchemy import or_
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy import Column, Index, Integer, String, Table, delete, func, insert
+from sqlalchemy import inspect
+from sqlalchemy import and_, bindparam, literal, or_, text, tuple_, union, update
+from sqlalchemy.exc import DBAPIError, SAWarning
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+from .cache import FULL_POLICY, filter_key
+from .engine import EngineOptions
+from .instrumentation import instrumented, record_rows, watch_engine
+from .snapshot import PolicySnapshot, write_snapshot
+from .watcher import ChangeEvent, apply_change
+
+logger = logging.getLogger(__name__)
+
 Base = declarative_base()
 
+# dialects that accept row values in IN, e.g. (ptype, v0) IN ((...), (...))
+TUPLE_IN_DIALECTS = ("postgresql", "mysql", "mariadb", "sqlite")
+
+FILTER_ATTRS = ("ptype", "v0", "v1", "v2", "v3", "v4", "v5")
+
+# dialects that can build the unique rule index and skip rows conflicting with it;
+# its coalesced key parts exceed InnoDB's key length, so MySQL is not one
+UPSERT_DIALECTS = ("postgresql", "sqlite")
+
+# column sets that cover the lookups done by remove, update and filtered loads
+RECOMMENDED_INDEXES = (("ptype", "v0", "v1"), ("ptype", "v1"))
+
+
+def _index_name(table_name, columns):
+    return "idx_{}_{}".format(table_name, "_".join(columns))
+
+
+def _unique_index_name(table_name):
+    return "uq_{}_rule".format(table_name)
+
+
+async def gather_limited(coroutines, limit):
+    """awaits the coroutines with at most limit running at once, results keep their order."""
+    if limit <= 1:
+        return [await coroutine for coroutine in coroutines]
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(coroutine) for coroutine in coroutines))
+
 
 class CasbinRule(Base):
     __tablename__ = "casbin_rule"
+    __table_args__ = tuple(
+        Index(_index_name("casbin_rule", columns), *columns)
+        for columns in RECOMMENDED_INDEXES
+    )
 
     id = Column(Integer, primary_key=True)
     ptype = Column(String(255))
@@ -50,6 +101,45 @@ class CasbinRule(Base):
         return '<CasbinRule {}: "{}">'.format(self.id, str(self))
 
 
+LogBase = declarative_base()
+
+
+class CasbinRuleLog(LogBase):
+    """an append-only record of policy changes, its id doubles as the policy version."""
+
+    __tablename__ = "casbin_rule_log"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    op = Column(String(16), nullable=False)
+    ptype = Column(String(255))
+    v0 = Column(String(255))
+    v1 = Column(String(255))
+    v2 = Column(String(255))
+    v3 = Column(String(255))
+    v4 = Column(String(255))
+    v5 = Column(String(255))
+
+
+def _version_table(changelog):
+    """the one-row table each write bumps before it appends to changelog.
+
+    The row lock of that update is held until commit, so writers append to the
+    log one after another and log ids follow commit order. A reader that sees
+    id n has therefore seen every change below n.
+    """
+    table = changelog.__table__
+    name = "{}_version".format(table.name)
+    if name in table.metadata.tables:
+        return table.metadata.tables[name]
+    return Table(
+        name,
+        table.metadata,
+        Column("id", Integer, primary_key=True, autoincrement=False),
+        Column("version", Integer, nullable=False),
+        schema=table.schema,
+    )
+
+
 class Filter:
     ptype = []
     v0 = []
@@ -63,9 +153,40 @@ class Filter:
 class Adapter(AsyncAdapter):
     """the interface for Casbin adapters."""
 
-    def __init__(self, engine, db_class=None, filtered=False, warning=True):
+    def __init__(
+        self,
+        engine,
+        db_class=None,
+        filtered=False,
+        warning=True,
+        batch_size=1000,
+        changelog=False,
+        cache=None,
+        use_copy=False,
+        max_bind_params=999,
+        order_filtered=True,
+        filter_concurrency=1,
+        write_behind=None,
+        read_engines=None,
+        replica_retry_interval=30,
+        observers=None,
+        diff_save=False,
+        intern_values=False,
+        engine_options=None,
+        session_options=None,
+        publisher=None,
+        upsert=False,
+    ):
+        if engine_options is None:
+            engine_options = EngineOptions()
+        elif isinstance(engine_options, dict):
+            engine_options = EngineOptions(**engine_options)
+        self._engine_options = engine_options
+        self._session_options = {"expire_on_commit": False, "class_": AsyncSession}
+        self._session_options.update(session_options or {})
+
         if isinstance(engine, str):
-            self._engine = create_async_engine(engine, future=True)
+            self._engine = engine_options.create_engine(engine)
         else:
             self._engine = engine
 
@@ -93,15 +214,81 @@ class Adapter(AsyncAdapter):
             Base.metadata = db_class.metadata
 
         self._db_class = db_class
-        self.session_local = sessionmaker(
-            self._engine, expire_on_commit=False, class_=AsyncSession
-        )
+        self.session_local = sessionmaker(self._engine, **self._session_options)
 
         self._filtered = filtered
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer.")
+        self._batch_size = batch_size
+        if changelog is True:
+            changelog = CasbinRuleLog
+        elif changelog:
+            for attr in ("id", "op", "ptype", "v0", "v1", "v2", "v3", "v4", "v5"):
+                if not hasattr(changelog, attr):
+                    raise Exception(f"{attr} not found in custom change log class.")
+        self._changelog = changelog or None
+        self._version_table = _version_table(changelog) if changelog else None
+        self._cache = cache
+        self._use_copy = use_copy
+        self._max_bind_params = max_bind_params
+        self._order_filtered = order_filtered
+        self._filter_concurrency = filter_concurrency
+        self._diff_save = diff_save
+        if upsert and self._engine.dialect.name not in UPSERT_DIALECTS:
+            raise ValueError(
+                "upsert is not supported on {}.".format(self._engine.dialect.name)
+            )
+        self._upsert = upsert
+        self._upsert_checked = False
+        self._publisher = publisher
+        if publisher is not None:
+            publisher.attach(self)
+        self._intern_values = intern_values
+        self._write_behind = write_behind
+        if write_behind is not None:
+            write_behind.attach(self)
+
+        self._read_sessions = []
+        self._read_engines = []
+        for read_engine in read_engines or []:
+            if isinstance(read_engine, str):
+                read_engine = engine_options.create_engine(read_engine)
+            self._read_engines.append(read_engine)
+            self._read_sessions.append(
+                sessionmaker(read_engine, **self._session_options)
+            )
+        self._replica_retry_interval = replica_retry_interval
+        self._replica_down_until = [0.0] * len(self._read_sessions)
+        self._next_replica = 0
+
+        self._transaction = contextvars.ContextVar(
+            "casbin_adapter_transaction", default=None
+        )
+
+        self._statements = {}
+
+        self._observers = []
+        for observer in observers or []:
+            self.add_observer(observer)
+
+    def add_observer(self, observer):
+        """registers an observer whose on_operation(event) is called after every public call.
+
+        Statement counting hooks into the engines only once an observer is added,
+        so an adapter without observers runs uninstrumented.
+        """
+        for engine in [self._engine, *self._read_engines]:
+            watch_engine(engine)
+        self._observers.append(observer)
 
     @asynccontextmanager
     async def _session_scope(self):
         """Provide an asynchronous transactional scope around a series of operations."""
+        session = self._transaction.get()
+        if session is not None:
+            # the enclosing transaction() commits or rolls back
+            yield session
+            return
         async with self.session_local() as session:
             try:
                 yield session
@@ -109,111 +296,1137 @@ class Adapter(AsyncAdapter):
             except Exception as e:
                 await session.rollback()
                 raise e
+            await self._publish(session)
+
+    def _replica_order(self):
+        """returns the healthy replicas, round robin from the next one in turn."""
+        count = len(self._read_sessions)
+        start = self._next_replica
+        self._next_replica = (start + 1) % count
+        now = time.monotonic()
+        return [
+            index
+            for index in ((start + offset) % count for offset in range(count))
+            if self._replica_down_until[index] <= now
+        ]
+
+    @asynccontextmanager
+    async def _read_scope(self, use_primary=False):
+        """a session for bulk loads, on a read replica when any is configured.
+
+        A replica that fails to hand out a connection is skipped for
+        replica_retry_interval seconds, and the primary is used when none is
+        healthy or use_primary is set. Inside transaction() the transaction's
+        session is used.
+        """
+        if self._transaction.get() is not None:
+            use_primary = True
+        if not use_primary and self._read_sessions:
+            for index in self._replica_order():
+                session = self._read_sessions[index]()
+                try:
+                    await session.connection()
+                except (DBAPIError, OSError):
+                    await session.close()
+                    self._replica_down_until[index] = (
+                        time.monotonic() + self._replica_retry_interval
+                    )
+                    continue
+                async with session:
+                    yield session
+                return
+        async with self._session_scope() as session:
+            yield session
+
+    @asynccontextmanager
+    async def _write_scope(self):
+        """a session scope for writes, the policy cache is invalidated once it commits.
+
+        With the change log the version row is locked before any data statement,
+        so every writer takes its locks in the same order.
+        """
+        in_transaction = self._transaction.get() is not None
+        async with self._session_scope() as session:
+            if self._changelog:
+                await self._lock_version(session)
+            yield session
+        if not in_transaction:
+            self.invalidate()
+
+    @asynccontextmanager
+    async def transaction(self):
+        """runs every adapter call inside the block in one session and transaction.
+
+        The calls share one connection, nothing is committed until the block
+        exits and an exception rolls all of them back. Writes bypass the
+        write-behind queue and loads read the transaction's own writes from the
+        primary, without the policy cache. Nested blocks join the outer one. The
+        transaction belongs to the task that opened it, do not run adapter calls
+        concurrently inside it.
+
+            async with adapter.transaction():
+                await adapter.remove_filtered_policy("g", "g", 2, "tenant1")
+                await adapter.add_policies("g", "g", new_roles)
+        """
+        if self._transaction.get() is not None:
+            yield
+            return
+        await self.flush()
+        async with self.session_local() as session:
+            token = self._transaction.set(session)
+            try:
+                yield
+                await session.commit()
+            except BaseException:
+                await session.rollback()
+                raise
+            finally:
+                self._transaction.reset(token)
+            await self._publish(session)
+        self.invalidate()
+
+    async def _publish(self, session):
+        """hands the changes a committed session made to the publisher.
+
+        The changes are already stored, so a failing publisher is only logged.
+        """
+        events = session.info.pop("casbin_changes", None)
+        if not events or self._publisher is None:
+            return
+        try:
+            await self._publisher.publish(events)
+        except Exception:
+            logger.warning(
+                "publishing %d policy changes failed", len(events), exc_info=True
+            )
+
+    def _queued(self):
+        """whether writes go through the write-behind queue, never inside a transaction."""
+        return self._write_behind is not None and self._transaction.get() is None
+
+    def invalidate(self):
+        """drops every cached policy load, e.g. after a change notification from another node."""
+        if self._cache is not None:
+            self._cache.invalidate()
+
+    async def flush(self):
+        """waits until every queued write-behind change is committed.
 
+        Inside transaction() this is a no-op, the queue was flushed when it began.
+        """
+        if self._queued():
+            await self._write_behind.flush()
+
+    async def aclose(self):
+        """flushes and stops the write-behind queue, if any."""
+        if self._write_behind is not None:
+            await self._write_behind.aclose()
+
+    @instrumented
+    async def warmup(self, connections=None):
+        """opens pool connections and runs the load selects before traffic arrives.
+
+        connections defaults to the pool size of each engine. Every connection
+        starts the full-load select, closing it before any row is fetched, and
+        reads the change log version when it is enabled. Only these two selects
+        are compiled and, on asyncpg, prepared up front; the per-rule write
+        statements are prepared on their first use. Returns the number of
+        connections warmed.
+        """
+
+        async def warm(engine):
+            async with engine.connect() as conn:
+                result = await conn.stream(select(*self._rule_columns()))
+                await result.close()
+                if self._changelog:
+                    await conn.execute(select(func.max(self._changelog.id)))
+
+        warmed = 0
+        for engine in [self._engine, *self._read_engines]:
+            size = getattr(engine.pool, "size", None)
+            if size is None:
+                # a single shared connection, e.g. in-memory SQLite
+                count = 1
+            else:
+                count = connections or size()
+            await asyncio.gather(*(warm(engine) for _ in range(count)))
+            warmed += count
+        return warmed
+
+    @instrumented
     async def create_table(self):
-        """Creates default casbin rule table."""
+        """Creates default casbin rule table.
+
+        In upsert mode the unique rule index is created too.
+        """
         async with self._engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            if self._changelog:
+                await conn.run_sync(self._changelog.__table__.create, checkfirst=True)
+                await conn.run_sync(self._version_table.create, checkfirst=True)
+                result = await conn.execute(
+                    select(func.count()).select_from(self._version_table)
+                )
+                if not result.scalar():
+                    await conn.execute(
+                        insert(self._version_table).values(id=1, version=0)
+                    )
+        if self._upsert:
+            await self.ensure_indexes(unique=True)
+
+    @instrumented
+    async def deduplicate(self):
+        """deletes duplicate rules, keeping the oldest row of each, and returns the count.
+
+        Missing and empty fields count as equal, like in the unique index, which
+        can be created once this has run. The policy itself does not change, so
+        nothing is logged.
+        """
+        table = self._db_class.__table__
+        columns = inspect(self._db_class).columns
+
+        def rule_key(columns):
+            return [columns["ptype"]] + [
+                func.coalesce(columns["v{}".format(i)], "") for i in range(6)
+            ]
+
+        if self._engine.dialect.name in ("mysql", "mariadb"):
+            # MySQL cannot select from the table it deletes from, a self join can
+            older = table.alias("older")
+            stmt = delete(table).where(
+                columns["id"] > older.c[columns["id"].name],
+                *(
+                    a == b
+                    for a, b in zip(
+                        rule_key(columns), rule_key(self._alias_columns(older))
+                    )
+                ),
+            )
+        else:
+            keep = select(func.min(columns["id"])).group_by(*rule_key(columns))
+            stmt = delete(table).where(columns["id"].not_in(keep))
+
+        await self.flush()
+        async with self._write_scope() as session:
+            r = await session.execute(stmt)
+            record_rows(written=r.rowcount)
+        return r.rowcount
+
+    def _alias_columns(self, alias):
+        """maps the rule attribute names to the columns of an alias of the table."""
+        columns = inspect(self._db_class).columns
+        return {attr: alias.c[column.name] for attr, column in columns.items()}
+
+    def _log_rule_columns(self):
+        return [self._changelog.ptype] + [
+            getattr(self._changelog, "v{}".format(i)) for i in range(6)
+        ]
+
+    def _recommended_indexes(self, unique=False):
+        """builds the recommended indexes for the rule table, reusing declared ones."""
+        table = self._db_class.__table__
+        columns = inspect(self._db_class).columns
+        declared = {index.name: index for index in table.indexes}
+        initial = set(declared)
+        indexes = []
+        for attrs in RECOMMENDED_INDEXES:
+            name = _index_name(table.name, attrs)
+            if name not in declared:
+                declared[name] = Index(name, *(columns[attr] for attr in attrs))
+            indexes.append(declared[name])
+        if unique:
+            # NULLs never conflict in a unique index, so the unused v columns are coalesced
+            name = _unique_index_name(table.name)
+            if name not in declared:
+                declared[name] = Index(
+                    name,
+                    columns["ptype"],
+                    *(func.coalesce(columns["v{}".format(i)], "") for i in range(6)),
+                    unique=True,
+                )
+            indexes.append(declared[name])
+        for index in indexes:
+            # keep the shared metadata as declared, create_all must not pick these up
+            if index.name not in initial:
+                table.indexes.discard(index)
+        return indexes
+
+    @instrumented
+    async def ensure_indexes(self, unique=False):
+        """creates the recommended indexes on an existing rule table.
+
+        Indexes that already exist, by name or by column list, are left alone.
+        With unique=True a unique index over (ptype, v0, ..., v5) is added too,
+        which MySQL and MariaDB cannot build. Returns the names of the indexes
+        that were created.
+        """
+        if unique and self._engine.dialect.name not in UPSERT_DIALECTS:
+            raise ValueError(
+                "the unique rule index is not supported on {}.".format(
+                    self._engine.dialect.name
+                )
+            )
+
+        def create_missing(conn):
+            existing, names = self._existing_indexes(conn)
+            column_lists = {tuple(index["column_names"]) for index in existing}
+            created = []
+            for index in self._recommended_indexes(unique):
+                column_list = tuple(c.name for c in index.columns) or None
+                if index.name in names or (
+                    not index.unique and column_list in column_lists
+                ):
+                    continue
+                index.create(conn)
+                created.append(index.name)
+            return created
+
+        async with self._engine.begin() as conn:
+            return await conn.run_sync(create_missing)
+
+    def _existing_indexes(self, conn):
+        """returns the reflected indexes of the rule table and the names of all of them."""
+        table_name = self._db_class.__table__.name
+        with warnings.catch_warnings():
+            # expression-based indexes are not reflected on every dialect
+            warnings.simplefilter("ignore", SAWarning)
+            existing = inspect(conn).get_indexes(table_name)
+        names = {index["name"] for index in existing}
+        if conn.dialect.name == "sqlite":
+            result = conn.execute(
+                text(
+                    "SELECT name FROM sqlite_master "
+                    "WHERE type = 'index' AND tbl_name = :table_name"
+                ),
+                {"table_name": table_name},
+            )
+            names.update(result.scalars())
+        return existing, names
+
+    def _rule_columns(self):
+        return [self._db_class.ptype] + [
+            getattr(self._db_class, "v{}".format(i)) for i in range(6)
+        ]
+
+    async def _stream_rows(self, session, stmt):
+        """yields chunks of (ptype, v0, ..., v5) tuples for a column-level select."""
+        result = await session.stream(
+            stmt.execution_options(yield_per=self._batch_size)
+        )
+        async for partition in result.partitions(self._batch_size):
+            record_rows(read=len(partition))
+            yield partition
 
-    async def load_policy(self, model):
-        """loads all policy rules from the storage."""
+    @staticmethod
+    def _row_to_rule(row):
+        rule = []
+        for v in row[1:]:
+            if v is None:
+                break
+            rule.append(v)
+        return rule
+
+    @staticmethod
+    def _load_policy_rows(rows, model, values=None):
+        """appends (ptype, v0, ..., v5) rows to the model without a string round trip.
+
+        values is an optional intern pool, a dict shared by every call of one
+        load, so that equal field values end up as one string object.
+        """
+        policies = {}
+        for row in rows:
+            ptype = row[0]
+            if ptype not in policies:
+                sec = ptype[:1] if ptype else None
+                if sec in model.model.keys() and ptype in model.model[sec].keys():
+                    policies[ptype] = model.model[sec][ptype].policy
+                else:
+                    policies[ptype] = None
+            policy = policies[ptype]
+            if policy is None:
+                continue
+            rule = []
+            if values is None:
+                for v in row[1:]:
+                    if v is None:
+                        break
+                    rule.append(v)
+            else:
+                for v in row[1:]:
+                    if v is None:
+                        break
+                    rule.append(values.setdefault(v, v))
+            policy.append(rule)
+
+    def _intern_pool(self):
+        """a fresh intern pool for one load, or None when interning is off."""
+        return {} if self._intern_values else None
+
+    def _require_changelog(self):
+        if self._changelog is None:
+            raise RuntimeError(
+                "the change log is disabled, pass changelog=True to Adapter."
+            )
+
+    @instrumented
+    async def get_version(self):
+        """returns the latest change log version, 0 when nothing has been logged.
+
+        Every write method bumps the version, so it is a cheap stamp of the stored
+        policy: one indexed MAX over the primary key of the change log.
+        """
+        self._require_changelog()
+        await self.flush()
         async with self._session_scope() as session:
-            lines = await session.execute(select(self._db_class))
-            for line in lines.scalars():
-                persist.load_policy_line(str(line), model)
+            result = await session.execute(select(func.max(self._changelog.id)))
+            return result.scalar() or 0
+
+    @instrumented
+    async def has_changed(self, since):
+        """returns whether the stored policy changed after version since."""
+        return await self.get_version() != since
+
+    @instrumented
+    async def load_policy_if_changed(self, model, token):
+        """reloads the model in full only when the policy changed after token.
+
+        Returns (reloaded, token), pass the returned token to the next call.
+        """
+        version = await self.get_version()
+        if version == token:
+            return False, token
+        model.clear_policy()
+        # the version was read on the primary, a lagging replica could miss changes
+        await self.load_policy(model, use_primary=True)
+        return True, version
+
+    @instrumented
+    async def load_policy_delta(self, model, since_version):
+        """applies the changes logged after since_version to a loaded model.
+
+        Changes are applied idempotently. A logged save_policy makes the model
+        reload in full. Returns the version to pass to the next call; the caller
+        is responsible for rebuilding role links when grouping rules changed.
+        """
+        self._require_changelog()
+        version = since_version
+        changes = []
+        reset = False
+        async with self._session_scope() as session:
+            stmt = (
+                select(
+                    self._changelog.id, self._changelog.op, *self._log_rule_columns()
+                )
+                .where(self._changelog.id > since_version)
+                .order_by(self._changelog.id)
+            )
+            async for rows in self._stream_rows(session, stmt):
+                for row in rows:
+                    version = row[0]
+                    if row[1] == "reset":
+                        reset = True
+                        changes = []
+                    else:
+                        changes.append((row[1], row[2], self._row_to_rule(row[2:])))
+
+        if version != since_version:
+            # the log moved on, so other nodes wrote since our cached loads
+            self.invalidate()
+
+        if reset:
+            model.clear_policy()
+            await self.load_policy(model, use_primary=True)
+            return version
+
+        for op, ptype, rule in changes:
+            apply_change(model, op, ptype, rule)
+        return version
+
+    @instrumented
+    async def save_snapshot(self, path):
+        """writes the stored policy to a snapshot file for load_policy_from_snapshot.
+
+        With the change log enabled the snapshot carries the version read before
+        the rows, so replaying the delta from it never misses a change. Returns
+        that version, or None without the change log.
+        """
+        version = await self.get_version() if self._changelog else None
+        rows = await self._select_rows(use_primary=True)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, write_snapshot, path, rows, version)
+        return version
+
+    @instrumented
+    async def load_policy_from_snapshot(self, model, path):
+        """loads a snapshot written by save_snapshot into the model, without the database.
+
+        Returns the snapshot's version, pass it to load_policy_delta to catch up
+        with the changes made since the snapshot was taken.
+        """
+        with PolicySnapshot(path) as snapshot:
+            for rows in snapshot.partitions(self._batch_size):
+                record_rows(read=len(rows))
+                self._load_policy_rows(rows, model)
+            return snapshot.version
+
+    @staticmethod
+    def _filter_lists(filter):
+        lists = []
+        for attr in FILTER_ATTRS:
+            values = getattr(filter, attr)
+            if len(values) > 0:
+                lists.append((attr, list(dict.fromkeys(values))))
+        return lists
+
+    def _filter_statements(self, filter, with_id=False):
+        """splits a filtered select so no statement exceeds max_bind_params.
+
+        Each non-empty Filter attribute becomes an IN clause. The shortest lists
+        are kept whole while the others still get at least one parameter each,
+        usually only the longest list is cut into chunks and there is one
+        statement per chunk. Lists that cannot be kept whole share the rest of
+        the budget, with one statement per combination of their chunks. With
+        with_id the id is selected first and the statements are left unordered.
+        """
+        lists = sorted(self._filter_lists(filter), key=lambda item: len(item[1]))
+        budget = self._max_bind_params
+        whole = 0
+        for attr, values in lists:
+            # every list after this one still needs one parameter
+            if len(values) + len(lists) - whole - 1 > budget:
+                break
+            budget -= len(values)
+            whole += 1
+        chunk_size = max(1, budget // max(1, len(lists) - whole))
+
+        columns = self._rule_columns()
+        if with_id:
+            columns = [self._db_class.id, *columns]
+        stmt = select(*columns)
+        for attr, values in lists[:whole]:
+            stmt = stmt.where(getattr(self._db_class, attr).in_(values))
+        statements = [stmt]
+        for attr, values in lists[whole:]:
+            column = getattr(self._db_class, attr)
+            statements = [
+                stmt.where(column.in_(values[start : start + chunk_size]))
+                for stmt in statements
+                for start in range(0, len(values), chunk_size)
+            ]
+        if self._order_filtered and not with_id:
+            statements = [stmt.order_by(self._db_class.id) for stmt in statements]
+        return statements
+
+    async def _select_statement_rows(self, stmt, use_primary=False):
+        rows = []
+        async with self._read_scope(use_primary) as session:
+            async for chunk in self._stream_rows(session, stmt):
+                rows.extend(chunk)
+        return rows
+
+    async def _select_rows(self, filter=None, use_primary=False):
+        """reads the (ptype, v0, ..., v5) rows of a full or filtered load into a list."""
+        if filter is None:
+            return await self._select_statement_rows(
+                select(*self._rule_columns()), use_primary
+            )
+        results = await gather_limited(
+            [
+                self._select_statement_rows(stmt, use_primary)
+                for stmt in self._filter_statements(filter)
+            ],
+            # a transaction's single session cannot run statements concurrently
+            1 if self._transaction.get() is not None else self._filter_concurrency,
+        )
+        return [row for rows in results for row in rows]
+
+    @instrumented
+    async def load_policy(self, model, use_primary=False):
+        """loads all policy rules from the storage.
+
+        Reads go to a read replica when any is configured, pass use_primary=True
+        to read your own writes.
+        """
+        await self.flush()
+        use_primary = use_primary or self._transaction.get() is not None
+        values = self._intern_pool()
+        if self._cache is not None and not use_primary:
+            rows = await self._cache.get_or_load(FULL_POLICY, self._select_rows)
+            self._load_policy_rows(rows, model, values)
+            return
+        async with self._read_scope(use_primary) as session:
+            stmt = select(*self._rule_columns())
+            async for rows in self._stream_rows(session, stmt):
+                self._load_policy_rows(rows, model, values)
 
     def is_filtered(self):
         return self._filtered
 
-    async def load_filtered_policy(self, model, filter) -> None:
-        """loads all policy rules from the storage."""
-        async with self._session_scope() as session:
-            stmt = select(self._db_class)
-            stmt = self.filter_query(stmt, filter)
-            result = await session.execute(stmt)
-            for line in result.scalars():
-                persist.load_policy_line(str(line), model)
-            self._filtered = True
+    @instrumented
+    async def load_filtered_policy(self, model, filter, use_primary=False) -> None:
+        """loads all policy rules from the storage.
+
+        Large filters are split into parameter-limit-safe statements. They run one
+        after another in one session and stream into the model, or concurrently on
+        separate connections when filter_concurrency is above 1. Like load_policy
+        they read from a replica unless use_primary is set.
+        """
+        await self.flush()
+        use_primary = use_primary or self._transaction.get() is not None
+        values = self._intern_pool()
+        if self._cache is not None and not use_primary:
+            rows = await self._cache.get_or_load(
+                filter_key(filter), lambda: self._select_rows(filter)
+            )
+            self._load_policy_rows(rows, model, values)
+        elif self._filter_concurrency > 1 and self._transaction.get() is None:
+            rows = await self._select_rows(filter, use_primary)
+            self._load_policy_rows(rows, model, values)
+        else:
+            async with self._read_scope(use_primary) as session:
+                for stmt in self._filter_statements(filter):
+                    async for rows in self._stream_rows(session, stmt):
+                        self._load_policy_rows(rows, model, values)
+        self._filtered = True
+
+    def _pool_size(self):
+        size = getattr(self._engine.pool, "size", None)
+        return 1 if size is None else size()
+
+    @instrumented
+    async def load_filtered_policies(
+        self, model, filters, concurrency=None, use_union=None, use_primary=False
+    ) -> None:
+        """loads the policy rules matching any of the filters, e.g. one per tenant.
+
+        With use_union the filters are merged into one UNION query, otherwise
+        each filter's statements run concurrently on up to concurrency pooled
+        connections, the pool size by default. use_union=None picks the UNION
+        when all filters fit into max_bind_params together. A row matched by
+        several filters is loaded once and rows are applied in id order. Loads
+        bypass the policy cache.
+        """
+        filters = list(filters)
+        await self.flush()
+        in_transaction = self._transaction.get() is not None
+        use_primary = use_primary or in_transaction
+        statements = [
+            stmt for filter in filters for stmt in self._filter_statements(filter, True)
+        ]
+        if use_union is None:
+            params = sum(
+                len(values)
+                for filter in filters
+                for _, values in self._filter_lists(filter)
+            )
+            use_union = params <= self._max_bind_params
+
+        if len(statements) > 1 and use_union:
+            merged = union(*statements).subquery()
+            stmt = select(*merged.c).order_by(merged.c[0])
+            rows = await self._select_statement_rows(stmt, use_primary)
+        else:
+            if in_transaction:
+                # a transaction's single session cannot run statements concurrently
+                concurrency = 1
+            results = await gather_limited(
+                [self._select_statement_rows(stmt, use_primary) for stmt in statements],
+                concurrency or self._pool_size(),
+            )
+            by_id = {row[0]: row for rows in results for row in rows}
+            rows = [by_id[id] for id in sorted(by_id)]
+        self._load_policy_rows((row[1:] for row in rows), model, self._intern_pool())
+        self._filtered = True
 
     def filter_query(self, stmt, filter):
-        for attr in ("ptype", "v0", "v1", "v2", "v3", "v4", "v5"):
+        for attr in FILTER_ATTRS:
             if len(getattr(filter, attr)) > 0:
                 stmt = stmt.where(
                     getattr(self._db_class, attr).in_(getattr(filter, attr))
                 )
-        return stmt.order_by(self._db_class.id)
+        if self._order_filtered:
+            stmt = stmt.order_by(self._db_class.id)
+        return stmt
+
+    def _rule_params(self, ptype, rule):
+        params = {"ptype": ptype}
+        for i in range(6):
+            params["v{}".format(i)] = rule[i] if i < len(rule) else None
+        return params
+
+    async def _insert_rules(self, session, ptype_rules):
+        """inserts (ptype, rule) pairs with one executemany per batch.
+
+        SQLAlchemy compiles a single INSERT and hands each batch to the driver's
+        executemany, which uses the multi-VALUES ("insertmanyvalues") or native
+        fast-executemany mode on PostgreSQL and MySQL. With use_copy=True on asyncpg
+        the rows are streamed through COPY instead.
+        """
+        if self._copy_supported():
+            await self._copy_rules(session, ptype_rules)
+            return
+        stmt = insert(self._db_class)
+        batch = []
+        for ptype, rule in ptype_rules:
+            batch.append(self._rule_params(ptype, rule))
+            if len(batch) >= self._batch_size:
+                await session.execute(stmt, batch)
+                record_rows(written=len(batch))
+                batch = []
+        if batch:
+            await session.execute(stmt, batch)
+            record_rows(written=len(batch))
+
+    def _copy_supported(self):
+        return self._use_copy and self._engine.dialect.driver == "asyncpg"
+
+    async def _copy_connection(self, session):
+        """returns the asyncpg connection behind the session's transaction.
+
+        SQLAlchemy's asyncpg driver only sends BEGIN before the first statement,
+        so one is run first; otherwise a COPY opening the transaction would
+        autocommit.
+        """
+        connection = await session.connection()
+        await connection.execute(select(literal(1)))
+        raw = await connection.get_raw_connection()
+        return raw.driver_connection
+
+    async def _copy_rules(self, session, ptype_rules):
+        """bulk inserts (ptype, rule) pairs with asyncpg's copy_records_to_table."""
+        table = self._db_class.__table__
+        mapped = inspect(self._db_class).columns
+        columns = [mapped["ptype"].name] + [
+            mapped["v{}".format(i)].name for i in range(6)
+        ]
+        count = 0
+
+        def records():
+            # streamed, asyncpg sends them as it goes without building one list
+            nonlocal count
+            for ptype, rule in ptype_rules:
+                count += 1
+                yield (ptype, *rule, *([None] * (6 - len(rule))))
+
+        connection = await self._copy_connection(session)
+        await connection.copy_records_to_table(
+            table.name, records=records(), columns=columns, schema_name=table.schema
+        )
+        record_rows(written=count)
+
+    async def _log_changes(self, session, op, ptype, rules):
+        """appends changes to the change log and queues them for the publisher."""
+        if self._publisher is not None:
+            session.info.setdefault("casbin_changes", []).append(
+                ChangeEvent(
+                    op, ptype, [] if op == "reset" else [list(r) for r in rules]
+                )
+            )
+        if not self._changelog:
+            return
+        stmt = insert(self._changelog)
+        batch = []
+        for rule in rules:
+            params = self._rule_params(ptype, rule)
+            params["op"] = op
+            batch.append(params)
+            if len(batch) >= self._batch_size:
+                await session.execute(stmt, batch)
+                batch = []
+        if batch:
+            await session.execute(stmt, batch)
+
+    async def _lock_version(self, session):
+        """bumps the version row once per transaction, before anything is written."""
+        if session.info.get("casbin_version_locked"):
+            return
+        table = self._version_table
+        result = await session.execute(
+            update(table).where(table.c.id == 1).values(version=table.c.version + 1)
+        )
+        if not result.rowcount:
+            # a version table that create_table did not seed
+            await session.execute(insert(table).values(id=1, version=1))
+        session.info["casbin_version_locked"] = True
 
     async def _save_policy_line(self, ptype, rule):
-        async with self._session_scope() as session:
-            line = self._db_class(ptype=ptype)
-            for i, v in enumerate(rule):
-                setattr(line, "v{}".format(i), v)
-            session.add(line)
+        async with self._write_scope() as session:
+            return await self._add_rules(session, ptype, [rule])
+
+    async def _add_rules(self, session, ptype, rules):
+        """inserts rules and returns how many were stored, only new ones in upsert mode."""
+        if self._upsert:
+            count, rules = await self._upsert_rules(session, ptype, rules)
+        else:
+            await self._insert_rules(session, ((ptype, rule) for rule in rules))
+            count = len(rules)
+        await self._log_changes(session, "add", ptype, rules)
+        return count
+
+    def _upsert_statement(self):
+        """an INSERT that skips rules already covered by the unique index.
+
+        ON CONFLICT DO NOTHING on PostgreSQL and SQLite. Where executemany
+        supports RETURNING the inserted rules are returned.
+        """
+        table = self._db_class.__table__
+        if self._engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+        stmt = dialect_insert(table).on_conflict_do_nothing()
+        if getattr(self._engine.dialect, "insert_executemany_returning", False):
+            columns = inspect(self._db_class).columns
+            stmt = stmt.returning(
+                columns["ptype"], *(columns["v{}".format(i)] for i in range(6))
+            )
+        return stmt
+
+    async def _upsert_rules(self, session, ptype, rules):
+        """inserts the rules that are not stored yet, in batches.
+
+        Returns the number of new rules and the rules to log: the new ones, or
+        every rule of a batch when the driver cannot return them.
+        """
+        if not self._upsert_checked:
+            await self._check_unique_index(session)
+        stmt = self._cached(("upsert",), self._upsert_statement)
+        count = 0
+        logged = []
+        for start in range(0, len(rules), self._batch_size):
+            chunk = rules[start : start + self._batch_size]
+            r = await session.execute(
+                stmt, [self._rule_params(ptype, rule) for rule in chunk]
+            )
+            if r.returns_rows:
+                new_rules = [self._row_to_rule(row) for row in r]
+                count += len(new_rules)
+                logged.extend(new_rules)
+            else:
+                count += r.rowcount
+                logged.extend(chunk)
+        record_rows(written=count)
+        return count, logged
+
+    async def _check_unique_index(self, session):
+        """without the unique index nothing conflicts and duplicates would be stored."""
+        connection = await session.connection()
+        _, names = await connection.run_sync(self._existing_indexes)
+        name = _unique_index_name(self._db_class.__table__.name)
+        if name not in names:
+            raise RuntimeError(
+                "upsert needs the unique index {}, call create_table() or "
+                "ensure_indexes(unique=True) first.".format(name)
+            )
+        self._upsert_checked = True
+
+    @staticmethod
+    def _model_rules(model):
+        """yields the (ptype, rule) pairs of the model's p and g sections."""
+        for sec in ["p", "g"]:
+            if sec not in model.model.keys():
+                continue
+            for ptype, ast in model.model[sec].items():
+                for rule in ast.policy:
+                    yield ptype, rule
 
+    @instrumented
     async def save_policy(self, model):
-        """saves all policy rules to the storage."""
-        async with self._session_scope() as session:
+        """saves all policy rules to the storage.
+
+        The existing rules are deleted and the new ones inserted in one transaction,
+        or only the difference is written when the adapter was built with
+        diff_save=True.
+        """
+        await self._replace_rules(self._model_rules(model))
+        return True
+
+    @instrumented
+    async def save_policy_diff(self, model):
+        """saves the model by writing only the rules that differ from the storage.
+
+        The stored rows are streamed and compared with the model's p and g
+        sections, then the surplus rows are deleted by id and the missing rules
+        inserted, in one transaction. Duplicate rules are matched by count.
+        Returns (added, removed) row counts.
+        """
+        return await self._sync_rules(self._model_rules(model))
+
+    async def _replace_rules(self, ptype_rules):
+        if self._diff_save:
+            await self._sync_rules(ptype_rules)
+            return
+        await self.flush()
+        async with self._write_scope() as session:
             stmt = delete(self._db_class)
             await session.execute(stmt)
-            for sec in ["p", "g"]:
-                if sec not in model.model.keys():
-                    continue
-                for ptype, ast in model.model[sec].items():
-                    for rule in ast.policy:
-                        await self._save_policy_line(ptype, rule)
-        return True
+            await self._insert_rules(session, ptype_rules)
+            await self._log_changes(session, "reset", None, [[]])
+
+    async def _sync_rules(self, ptype_rules):
+        await self.flush()
+        wanted = Counter((ptype, tuple(rule)) for ptype, rule in ptype_rules)
+        async with self._write_scope() as session:
+            stored = {}
+            stmt = select(self._db_class.id, *self._rule_columns()).order_by(
+                self._db_class.id
+            )
+            async for rows in self._stream_rows(session, stmt):
+                for row in rows:
+                    key = (row[1], tuple(self._row_to_rule(row[1:])))
+                    stored.setdefault(key, []).append(row[0])
+
+            removed_ids = []
+            removed = {}
+            for (ptype, rule), ids in stored.items():
+                surplus = len(ids) - wanted.get((ptype, rule), 0)
+                if surplus > 0:
+                    removed_ids.extend(ids[-surplus:])
+                    removed.setdefault(ptype, []).extend([list(rule)] * surplus)
+            added = []
+            for (ptype, rule), count in wanted.items():
+                missing = count - len(stored.get((ptype, rule), ()))
+                added.extend([(ptype, list(rule))] * missing)
 
+            for start in range(0, len(removed_ids), self._batch_size):
+                chunk = removed_ids[start : start + self._batch_size]
+                await session.execute(
+                    delete(self._db_class).where(self._db_class.id.in_(chunk))
+                )
+            record_rows(written=len(removed_ids))
+            await self._insert_rules(session, added)
+
+            for ptype, rules in removed.items():
+                await self._log_changes(session, "remove", ptype, rules)
+            added_by_ptype = {}
+            for ptype, rule in added:
+                added_by_ptype.setdefault(ptype, []).append(rule)
+            for ptype, rules in added_by_ptype.items():
+                await self._log_changes(session, "add", ptype, rules)
+        return len(added), len(removed_ids)
+
+    @instrumented
     async def add_policy(self, sec, ptype, rule):
-        """adds a policy rule to the storage."""
-        await self._save_policy_line(ptype, rule)
+        """adds a policy rule to the storage.
 
+        Returns 1, or 0 in upsert mode when the rule was already stored.
+        """
+        if self._queued():
+            await self._write_behind.add(ptype, [rule])
+            return
+        return await self._save_policy_line(ptype, rule)
+
+    @instrumented
     async def add_policies(self, sec, ptype, rules):
-        """adds a policy rules to the storage."""
-        for rule in rules:
-            await self._save_policy_line(ptype, rule)
+        """adds a policy rules to the storage.
 
+        Returns the number of rules stored, in upsert mode only the new ones.
+        """
+        if self._queued():
+            await self._write_behind.add(ptype, rules)
+            return
+        async with self._write_scope() as session:
+            return await self._add_rules(session, ptype, list(rules))
+
+    @instrumented
     async def remove_policy(self, sec, ptype, rule):
-        """removes a policy rule from the storage."""
-        async with self._session_scope() as session:
-            stmt = delete(self._db_class).where(self._db_class.ptype == ptype)
-            for i, v in enumerate(rule):
-                stmt = stmt.where(getattr(self._db_class, "v{}".format(i)) == v)
-            r = await session.execute(stmt)
+        """removes a policy rule from the storage.
+
+        Only the exact rule is deleted, longer rules sharing its fields are kept,
+        like in remove_policies and in write-behind mode.
+        """
+        if self._queued():
+            await self._write_behind.remove(ptype, [rule])
+            return True
+        fields = tuple(range(len(rule)))
+        params = self._match_params(ptype, fields, rule)
+        stmt = self._cached(
+            ("delete_rule", len(rule)),
+            lambda: delete(self._db_class.__table__).where(
+                self._rule_clause(len(rule))
+            ),
+        )
+        async with self._write_scope() as session:
+            r = await session.execute(stmt, params)
+            record_rows(written=r.rowcount)
+            if r.rowcount > 0:
+                await self._log_changes(session, "remove", ptype, [rule])
 
         return True if r.rowcount > 0 else False
 
+    def _cached(self, key, build):
+        """returns the statement cached under key, building it on first use.
+
+        The per-rule methods use one bindparam statement per shape, so SQLAlchemy's
+        compiled cache and the driver's prepared statements are reused.
+        """
+        stmt = self._statements.get(key)
+        if stmt is None:
+            stmt = self._statements[key] = build()
+        return stmt
+
+    def _match_clause(self, fields):
+        """matches ptype and the v columns at the fields indexes against bindparams."""
+        columns = inspect(self._db_class).columns
+        return and_(
+            columns["ptype"] == bindparam("ptype"),
+            *(columns["v{}".format(i)] == bindparam("v{}".format(i)) for i in fields),
+        )
+
+    def _rule_clause(self, length):
+        """matches exactly one rule of length fields, the next field must be NULL."""
+        clause = self._match_clause(tuple(range(length)))
+        if length < 6:
+            clause = and_(clause, self._rule_columns()[length + 1].is_(None))
+        return clause
+
+    @staticmethod
+    def _match_params(ptype, fields, values):
+        params = {"ptype": ptype}
+        for i, v in zip(fields, values):
+            params["v{}".format(i)] = v
+        return params
+
+    def _delete_statement(self, fields):
+        return self._cached(
+            ("delete", fields),
+            lambda: delete(self._db_class.__table__).where(self._match_clause(fields)),
+        )
+
+    def _rules_clause(self, ptype, rules, exact=True):
+        """builds a WHERE clause matching exactly the given rules of one ptype.
+
+        Rules are grouped by length and matched as row values, ``(ptype, v0, ...)
+        IN ((...), (...))``, on dialects that support it, or as an OR of ANDs.
+        Unless exact is False, the field after each rule must be NULL too, so
+        longer rules sharing the prefix are not matched.
+        """
+        by_length = {}
+        for rule in rules:
+            by_length.setdefault(len(rule), []).append((ptype, *rule))
+
+        clauses = []
+        for length, values in by_length.items():
+            columns = self._rule_columns()[: length + 1]
+            if self._engine.dialect.name in TUPLE_IN_DIALECTS:
+                clause = tuple_(*columns).in_(values)
+            else:
+                clause = or_(
+                    *(
+                        and_(*(c == v for c, v in zip(columns, value)))
+                        for value in values
+                    )
+                )
+            if exact and length < 6:
+                clause = and_(clause, self._rule_columns()[length + 1].is_(None))
+            clauses.append(clause)
+        return or_(*clauses)
+
+    @instrumented
     async def remove_policies(self, sec, ptype, rules):
-        """remove policy rules from the storage."""
+        """remove policy rules from the storage.
+
+        The rules are deleted in chunks of batch_size within one transaction.
+        Returns the number of deleted rows, or the number of queued rules in
+        write-behind mode.
+        """
+        rules = list(rules)
         if not rules:
-            return
-        async with self._session_scope() as session:
-            stmt = delete(self._db_class).where(self._db_class.ptype == ptype)
-            rules = zip(*rules)
-            for i, rule in enumerate(rules):
-                stmt = stmt.where(
-                    or_(getattr(self._db_class, "v{}".format(i)) == v for v in rule)
-                )
-            await session.execute(stmt)
+            return 0
+        if self._queued():
+            await self._write_behind.remove(ptype, rules)
+            return len(rules)
+        async with self._write_scope() as session:
+            return await self._remove_rules(session, ptype, rules)
+
+    async def _remove_rules(self, session, ptype, rules):
+        deleted = 0
+        for start in range(0, len(rules), self._batch_size):
+            chunk = rules[start : start + self._batch_size]
+            stmt = delete(self._db_class).where(self._rules_clause(ptype, chunk))
+            r = await session.execute(stmt)
+            deleted += r.rowcount
+        record_rows(written=deleted)
+        await self._log_changes(session, "remove", ptype, rules)
+        return deleted
+
+    @staticmethod
+    def _field_filter(field_index, field_values):
+        """returns the v column indexes and values a field filter matches on.
 
+        Empty values match anything, None is returned for an out of range filter.
+        """
+        if not (0 <= field_index <= 5):
+            return None
+        if not (1 <= field_index + len(field_values) <= 6):
+            return None
+        fields = []
+        values = []
+        for i, v in enumerate(field_values):
+            if v != "":
+                fields.append(field_index + i)
+                values.append(v)
+        return tuple(fields), values
+
+    @instrumented
     async def remove_filtered_policy(self, sec, ptype, field_index, *field_values):
         """removes policy rules that match the filter from the storage.
         This is part of the Auto-Save feature.
         """
-        async with self._session_scope() as session:
-            stmt = delete(self._db_class).where(self._db_class.ptype == ptype)
-
-            if not (0 <= field_index <= 5):
-                return False
-            if not (1 <= field_index + len(field_values) <= 6):
-                return False
-            for i, v in enumerate(field_values):
-                if v != "":
-                    v_value = getattr(self._db_class, "v{}".format(field_index + i))
-                    stmt = stmt.where(v_value == v)
-            r = await session.execute(stmt)
+        field_filter = self._field_filter(field_index, field_values)
+        if field_filter is None:
+            return False
+        fields, values = field_filter
+        params = self._match_params(ptype, fields, values)
+        await self.flush()
+        async with self._write_scope() as session:
+            if self._changelog or self._publisher is not None:
+                removed = await self._delete_matching(session, fields, params)
+                await self._log_changes(session, "remove", ptype, removed)
+                return len(removed) > 0
+            r = await session.execute(self._delete_statement(fields), params)
+            record_rows(written=r.rowcount)
 
         return True if r.rowcount > 0 else False
 
+    async def _delete_matching(self, session, fields, params):
+        """deletes the rows matching the fields and returns their rules in id order.
+
+        One DELETE ... RETURNING where the dialect supports it, otherwise the
+        matching ids are selected first and deleted in chunks of batch_size.
+        """
+        columns = [self._db_class.id, *self._rule_columns()]
+        if getattr(self._engine.dialect, "delete_returning", False):
+            stmt = self._cached(
+                ("delete_returning", fields),
+                lambda: delete(self._db_class)
+                .where(self._match_clause(fields))
+                .returning(*columns)
+                .execution_options(synchronize_session=False),
+            )
+            result = await session.execute(stmt, params)
+            rows = sorted(result.all(), key=lambda row: row[0])
+        else:
+            stmt = self._cached(
+                ("select_matching", fields),
+                lambda: select(*columns)
+                .where(self._match_clause(fields))
+                .order_by(self._db_class.id),
+            )
+            result = await session.execute(stmt, params)
+            rows = result.all()
+            for start in range(0, len(rows), self._batch_size):
+                ids = [row[0] for row in rows[start : start + self._batch_size]]
+                await session.execute(
+                    delete(self._db_class)
+                    .where(self._db_class.id.in_(ids))
+                    .execution_options(synchronize_session=False)
+                )
+        record_rows(written=len(rows))
+        return [self._row_to_rule(row[1:]) for row in rows]
+
+    @instrumented
     async def update_policy(
         self, sec: str, ptype: str, old_rule: List[str], new_rule: List[str]
     ) -> None:
@@ -227,27 +1440,38 @@ class Adapter(AsyncAdapter):
 
         :return: None
         """
+        if self._queued():
+            await self._write_behind.update(ptype, [old_rule], [new_rule])
+            return
 
-        async with self._session_scope() as session:
-            stmt = select(self._db_class).where(self._db_class.ptype == ptype)
+        columns = inspect(self._db_class).columns
+        fields = tuple(range(len(old_rule)))
+        # the columns up to the longest rule's length are overwritten
+        length = max(len(old_rule), len(new_rule))
+        find = self._cached(
+            ("find", fields),
+            lambda: select(columns["id"], *self._rule_columns()[1:]).where(
+                self._match_clause(fields)
+            ),
+        )
+        overwrite = self._overwrite_statement(length)
+        params = self._overwrite_params(None, new_rule, length)
 
+        async with self._write_scope() as session:
             # locate the old rule
-            for index, value in enumerate(old_rule):
-                v_value = getattr(self._db_class, "v{}".format(index))
-                stmt = stmt.where(v_value == value)
+            result = await session.execute(
+                find, self._match_params(ptype, fields, old_rule)
+            )
+            row = result.one()
+            params["old_id"] = row[0]
+            await session.execute(overwrite, params)
+            record_rows(read=1, written=1)
 
-            # need the length of the longest_rule to perform overwrite
-            longest_rule = old_rule if len(old_rule) > len(new_rule) else new_rule
-            result = await session.execute(stmt)
-            old_rule_line = result.scalar_one()
-
-            # overwrite the old rule with the new rule
-            for index in range(len(longest_rule)):
-                if index < len(new_rule):
-                    setattr(old_rule_line, "v{}".format(index), new_rule[index])
-                else:
-                    setattr(old_rule_line, "v{}".format(index), None)
+            stored, updated = self._rewritten_rules(ptype, row, new_rule, length)
+            await self._log_changes(session, "remove", ptype, [stored])
+            await self._log_changes(session, "add", ptype, [updated])
 
+    @instrumented
     async def update_policies(
         self,
         sec: str,
@@ -264,46 +1488,134 @@ class Adapter(AsyncAdapter):
         :param new_rules: the new rules to replace the old rules
 
         :return: None
-        """
-        for i in range(len(old_rules)):
-            await self.update_policy(sec, ptype, old_rules[i], new_rules[i])
 
-    async def update_filtered_policies(
-        self, sec, ptype, new_rules: List[List[str]], field_index, *field_values
-    ) -> List[List[str]]:
-        """update_filtered_policies updates all the policies on the basis of the filter."""
+        The old rules are looked up in chunks of batch_size and rewritten with one
+        executemany UPDATE keyed by id, all in a single transaction. If any old rule
+        is not found nothing is changed and a ValueError naming them is raised.
+        """
+        old_rules = [list(rule) for rule in old_rules]
+        new_rules = [list(rule) for rule in new_rules]
+        if len(old_rules) != len(new_rules):
+            raise ValueError("old_rules and new_rules must have the same length.")
+        if not old_rules:
+            return
+        if self._queued():
+            await self._write_behind.update(ptype, old_rules, new_rules)
+            return
 
-        filter = Filter()
-        filter.ptype = ptype
+        async with self._write_scope() as session:
+            await self._update_rules(session, ptype, old_rules, new_rules)
 
-        # Creating Filter from the field_index & field_values provided
-        for i in range(len(field_values)):
-            if field_index <= i and i < field_index + len(field_values):
-                setattr(filter, f"v{i}", field_values[i - field_index])
-            else:
-                break
+    async def _update_rules(self, session, ptype, old_rules, new_rules):
+        rows = await self._find_rule_rows(session, ptype, old_rules)
+        missing = [rule for rule, row in zip(old_rules, rows) if row is None]
+        if missing:
+            raise ValueError("old rules not found in storage: {}".format(missing))
 
-        return await self._update_filtered_policies(new_rules, filter)
+        # like update_policy, the columns up to the longer rule's length are overwritten
+        by_length = {}
+        removed = []
+        added = []
+        for row, old_rule, new_rule in zip(rows, old_rules, new_rules):
+            length = max(len(old_rule), len(new_rule))
+            by_length.setdefault(length, []).append(
+                self._overwrite_params(row[0], new_rule, length)
+            )
+            stored, updated = self._rewritten_rules(ptype, row, new_rule, length)
+            removed.append(stored)
+            added.append(updated)
+        for length, params in by_length.items():
+            stmt = self._overwrite_statement(length)
+            for start in range(0, len(params), self._batch_size):
+                await session.execute(stmt, params[start : start + self._batch_size])
+        record_rows(written=len(old_rules))
 
-    async def _update_filtered_policies(self, new_rules, filter) -> List[List[str]]:
-        """_update_filtered_policies updates all the policies on the basis of the filter."""
+        await self._log_changes(session, "remove", ptype, removed)
+        await self._log_changes(session, "add", ptype, added)
 
-        async with self._session_scope() as session:
-            # Load old policies
+    def _rewritten_rules(self, ptype, row, new_rule, length):
+        """returns the stored rule of an (id, v0, ..., v5) row and the rule it becomes.
 
-            stmt = select(self._db_class).where(self._db_class.ptype == filter.ptype)
-            filtered_stmt = self.filter_query(stmt, filter)
-            result = await session.execute(filtered_stmt)
-            old_rules = result.scalars().all()
+        Fields past length keep their stored values, so both can be longer than
+        the rules the caller passed; the change log records these.
+        """
+        values = list(row[1:])
+        stored = self._row_to_rule((ptype, *values))
+        for i in range(length):
+            values[i] = new_rule[i] if i < len(new_rule) else None
+        return stored, self._row_to_rule((ptype, *values))
 
-            # Delete old policies
+    def _overwrite_statement(self, length):
+        """an UPDATE by old_id of the first length v columns, cached per length."""
+        columns = inspect(self._db_class).columns
+        return self._cached(
+            ("update", length),
+            lambda: update(self._db_class.__table__)
+            .where(columns["id"] == bindparam("old_id"))
+            .values(
+                {
+                    columns["v{}".format(i)]: bindparam("new_v{}".format(i))
+                    for i in range(length)
+                }
+            ),
+        )
 
-            await self.remove_policies("p", filter.ptype, old_rules)
+    @staticmethod
+    def _overwrite_params(id, rule, length):
+        params = {"old_id": id}
+        for i in range(length):
+            params["new_v{}".format(i)] = rule[i] if i < len(rule) else None
+        return params
 
-            # Insert new policies
+    async def _find_rule_rows(self, session, ptype, rules):
+        """returns a distinct stored (id, v0, ..., v5) row per rule, None if missing."""
+        lengths = {len(rule) for rule in rules}
+        candidates = {}
+        for start in range(0, len(rules), self._batch_size):
+            chunk = rules[start : start + self._batch_size]
+            stmt = (
+                select(self._db_class.id, *self._rule_columns()[1:])
+                .where(self._rules_clause(ptype, chunk, exact=False))
+                .order_by(self._db_class.id)
+            )
+            result = await session.execute(stmt)
+            rows = result.all()
+            record_rows(read=len(rows))
+            for row in rows:
+                for length in lengths:
+                    matches = candidates.setdefault(tuple(row[1 : length + 1]), {})
+                    matches.setdefault(row[0], tuple(row))
 
-            await self.add_policies("p", filter.ptype, new_rules)
+        used = set()
+        found = []
+        for rule in rules:
+            match = None
+            for id, row in candidates.get(tuple(rule), {}).items():
+                if id not in used:
+                    match = row
+                    used.add(id)
+                    break
+            found.append(match)
+        return found
 
-            # return deleted rules
+    @instrumented
+    async def update_filtered_policies(
+        self, sec, ptype, new_rules: List[List[str]], field_index, *field_values
+    ) -> List[List[str]]:
+        """replaces the rules matching the field filter with new_rules.
 
-            return old_rules
+        The matching rows are removed with one set-based DELETE, RETURNING the
+        removed rules where supported, and the new rules are bulk inserted, all
+        in one transaction. Returns the removed rules.
+        """
+        field_filter = self._field_filter(field_index, field_values)
+        if field_filter is None:
+            return []
+        fields, values = field_filter
+        params = self._match_params(ptype, fields, values)
+        await self.flush()
+        async with self._write_scope() as session:
+            old_rules = await self._delete_matching(session, fields, params)
+            await self._log_changes(session, "remove", ptype, old_rules)
+            await self._add_rules(session, ptype, new_rules)
+        return old_rules
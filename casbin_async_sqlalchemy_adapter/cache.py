@@ -0,0 +1,118 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import time
+from collections import OrderedDict
+
+FULL_POLICY = "full"
+
+
+def filter_key(filter):
+    """normalizes a Filter into a hashable cache key."""
+    if filter is None:
+        return FULL_POLICY
+    key = []
+    for attr in ("ptype", "v0", "v1", "v2", "v3", "v4", "v5"):
+        values = getattr(filter, attr, None) or []
+        if isinstance(values, str):
+            values = [values]
+        if values:
+            key.append((attr, tuple(sorted(set(values)))))
+    return tuple(key)
+
+
+class PolicyCache:
+    """an in-process read-through cache of loaded policy rows.
+
+    Entries hold the (ptype, v0, ..., v5) row tuples of one load, keyed by the
+    normalized filter or FULL_POLICY. Entries expire after ttl seconds, when set,
+    and the least recently used ones are evicted once the cached rows exceed
+    max_rows. Concurrent misses on the same key share a single in-flight load.
+    """
+
+    def __init__(self, ttl=None, max_rows=1000000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._rows = 0
+        self._pending = {}
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """returns the cached rows for key, or None on a miss."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, rows = entry
+        if expires is not None and expires <= self._clock():
+            self._evict(key)
+            return None
+        self._entries.move_to_end(key)
+        return rows
+
+    def put(self, key, rows):
+        rows = tuple(rows)
+        if key in self._entries:
+            self._evict(key)
+        if len(rows) > self.max_rows:
+            return
+        expires = None if self.ttl is None else self._clock() + self.ttl
+        self._entries[key] = (expires, rows)
+        self._rows += len(rows)
+        while self._rows > self.max_rows:
+            self._evict(next(iter(self._entries)))
+
+    def invalidate(self, key=None):
+        """drops one entry, or every entry when key is None.
+
+        Loads that are in flight when the cache is invalidated are not stored.
+        """
+        if key is None:
+            self._entries.clear()
+            self._rows = 0
+            self._pending.clear()
+        else:
+            if key in self._entries:
+                self._evict(key)
+            self._pending.pop(key, None)
+        self._generation += 1
+
+    async def get_or_load(self, key, loader):
+        """returns the cached rows for key, awaiting loader() once on a miss."""
+        rows = self.get(key)
+        if rows is not None:
+            return rows
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, loader, self._generation))
+            self._pending[key] = task
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader, generation):
+        try:
+            rows = tuple(tuple(row) for row in await loader())
+            if generation == self._generation:
+                self.put(key, rows)
+            return rows
+        finally:
+            if self._pending.get(key) is asyncio.current_task():
+                del self._pending[key]
+
+    def _evict(self, key):
+        _, rows = self._entries.pop(key)
+        self._rows -= len(rows)
@@ -0,0 +1,86 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import QueuePool
+
+
+class EngineOptions:
+    """pool and statement cache settings for engines the adapter builds from a URL.
+
+    pool_size and max_overflow bound the connections per engine, pool_timeout is
+    how long a checkout waits for one; they only apply to queue pools, other
+    pools such as in-memory SQLite's, or file SQLite's on SQLAlchemy 1.4, do
+    not take them. pool_pre_ping tests a connection before
+    handing it out and pool_recycle replaces connections older than that many
+    seconds, which avoids server-side idle timeouts. query_cache_size is
+    SQLAlchemy's compiled statement cache, prepared_statement_cache_size the
+    per-connection asyncpg prepared statement cache, 0 disables it, e.g. behind
+    pgbouncer in transaction mode. Anything else in extra is passed on to
+    create_async_engine as is.
+    """
+
+    def __init__(
+        self,
+        pool_size=10,
+        max_overflow=10,
+        pool_timeout=30,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        query_cache_size=500,
+        prepared_statement_cache_size=100,
+        extra=None,
+    ):
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_pre_ping = pool_pre_ping
+        self.pool_recycle = pool_recycle
+        self.query_cache_size = query_cache_size
+        self.prepared_statement_cache_size = prepared_statement_cache_size
+        self.extra = dict(extra or {})
+
+    def _queue_pool(self, url):
+        poolclass = self.extra.get("poolclass") or url.get_dialect().get_pool_class(url)
+        return issubclass(poolclass, QueuePool)
+
+    def engine_kwargs(self, url):
+        """returns the create_async_engine arguments for url, and the url to use."""
+        url = make_url(url)
+        kwargs = {
+            "future": True,
+            "pool_pre_ping": self.pool_pre_ping,
+            "pool_recycle": self.pool_recycle,
+            "query_cache_size": self.query_cache_size,
+        }
+        if self._queue_pool(url):
+            kwargs.update(
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_timeout=self.pool_timeout,
+            )
+        if url.get_driver_name() == "asyncpg":
+            url = url.update_query_dict(
+                {
+                    "prepared_statement_cache_size": str(
+                        self.prepared_statement_cache_size
+                    )
+                }
+            )
+        kwargs.update(self.extra)
+        return url, kwargs
+
+    def create_engine(self, url):
+        url, kwargs = self.engine_kwargs(url)
+        return create_async_engine(url, **kwargs)
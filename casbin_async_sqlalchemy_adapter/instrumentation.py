@@ -0,0 +1,200 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import contextvars
+import functools
+import time
+
+from sqlalchemy import event
+
+_current = contextvars.ContextVar("casbin_adapter_operation", default=None)
+
+
+class OperationEvent:
+    """what one public adapter call did, handed to every observer when it returns.
+
+    outcome is "commit" when the call returned and "rollback" when it raised,
+    in which case error holds the exception. Calls made by another adapter
+    method are folded into the outer call's event.
+    """
+
+    __slots__ = (
+        "method",
+        "start_time",
+        "duration",
+        "rows_read",
+        "rows_written",
+        "statements",
+        "outcome",
+        "error",
+    )
+
+    def __init__(self, method):
+        self.method = method
+        self.start_time = time.time()
+        self.duration = 0.0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.statements = 0
+        self.outcome = None
+        self.error = None
+
+    def __repr__(self):
+        return "<OperationEvent {} {} {:.3f}s read={} written={} statements={}>".format(
+            self.method,
+            self.outcome,
+            self.duration,
+            self.rows_read,
+            self.rows_written,
+            self.statements,
+        )
+
+
+class AdapterObserver:
+    """base class for observers, override on_operation."""
+
+    def on_operation(self, event):
+        pass
+
+
+def record_rows(read=0, written=0):
+    """adds row counts to the operation in progress, if it is being observed."""
+    operation = _current.get()
+    if operation is not None:
+        operation.rows_read += read
+        operation.rows_written += written
+
+
+def detach():
+    """stops counting towards the caller's operation, for background tasks."""
+    _current.set(None)
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    operation = _current.get()
+    if operation is not None:
+        operation.statements += 1
+
+
+def watch_engine(engine):
+    """counts the statements an engine executes for the observed operation."""
+    sync_engine = engine.sync_engine
+    if not event.contains(sync_engine, "before_cursor_execute", _count_statement):
+        event.listen(sync_engine, "before_cursor_execute", _count_statement)
+
+
+def instrumented(method):
+    """reports the decorated adapter coroutine to the adapter's observers.
+
+    Without observers the call goes straight through.
+    """
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if not self._observers or _current.get() is not None:
+            return await method(self, *args, **kwargs)
+        operation = OperationEvent(method.__name__)
+        token = _current.set(operation)
+        start = time.perf_counter()
+        try:
+            result = await method(self, *args, **kwargs)
+            operation.outcome = "commit"
+            return result
+        except BaseException as e:
+            operation.outcome = "rollback"
+            operation.error = e
+            raise
+        finally:
+            operation.duration = time.perf_counter() - start
+            _current.reset(token)
+            for observer in self._observers:
+                observer.on_operation(operation)
+
+    return wrapper
+
+
+class OpenTelemetryObserver(AdapterObserver):
+    """records every operation as an OpenTelemetry span."""
+
+    def __init__(self, tracer=None):
+        try:
+            from opentelemetry import trace
+        except ImportError:  # pragma: no cover
+            raise ImportError(
+                "OpenTelemetryObserver requires the opentelemetry-api package."
+            )
+        self._trace = trace
+        self._tracer = tracer or trace.get_tracer("casbin_async_sqlalchemy_adapter")
+
+    def on_operation(self, event):
+        start = int(event.start_time * 1e9)
+        span = self._tracer.start_span(
+            "casbin.adapter.{}".format(event.method), start_time=start
+        )
+        span.set_attribute("casbin.adapter.rows_read", event.rows_read)
+        span.set_attribute("casbin.adapter.rows_written", event.rows_written)
+        span.set_attribute("casbin.adapter.statements", event.statements)
+        span.set_attribute("casbin.adapter.outcome", event.outcome)
+        if event.error is not None:
+            span.record_exception(event.error)
+            span.set_status(self._trace.Status(self._trace.StatusCode.ERROR))
+        span.end(end_time=start + int(event.duration * 1e9))
+
+
+class PrometheusObserver(AdapterObserver):
+    """exports operation latency, rows and statements as Prometheus metrics."""
+
+    def __init__(self, registry=None, namespace="casbin_adapter"):
+        try:
+            from prometheus_client import REGISTRY, Counter, Histogram
+        except ImportError:  # pragma: no cover
+            raise ImportError(
+                "PrometheusObserver requires the prometheus-client package."
+            )
+        registry = registry or REGISTRY
+        labels = ["method", "outcome"]
+        self.duration = Histogram(
+            "operation_duration_seconds",
+            "Adapter call latency.",
+            labels,
+            namespace=namespace,
+            registry=registry,
+        )
+        self.rows_read = Counter(
+            "rows_read",
+            "Rows read by adapter calls.",
+            labels,
+            namespace=namespace,
+            registry=registry,
+        )
+        self.rows_written = Counter(
+            "rows_written",
+            "Rows written by adapter calls.",
+            labels,
+            namespace=namespace,
+            registry=registry,
+        )
+        self.statements = Counter(
+            "statements",
+            "SQL statements executed by adapter calls.",
+            labels,
+            namespace=namespace,
+            registry=registry,
+        )
+
+    def on_operation(self, event):
+        labels = (event.method, event.outcome)
+        self.duration.labels(*labels).observe(event.duration)
+        self.rows_read.labels(*labels).inc(event.rows_read)
+        self.rows_written.labels(*labels).inc(event.rows_written)
+        self.statements.labels(*labels).inc(event.statements)
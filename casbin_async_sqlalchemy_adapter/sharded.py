@@ -0,0 +1,226 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import zlib
+from typing import List
+
+from casbin.persist.adapters.asyncio import AsyncAdapter
+
+from .adapter import Adapter
+
+
+class FieldRouter:
+    """routes rules to shards by a stable hash of one field, e.g. the domain.
+
+    field_index is the routed field for every ptype unless overridden in
+    ptype_fields, e.g. FieldRouter(4, field_index=1, ptype_fields={"g": 2}) for
+    RBAC with domains where p = sub, dom, obj, act and g = user, role, dom.
+    Rules too short to carry the field go to shard 0.
+    """
+
+    def __init__(self, shard_count, field_index=1, ptype_fields=None):
+        self.shard_count = shard_count
+        self.field_index = field_index
+        self.ptype_fields = dict(ptype_fields or {})
+
+    def shard_for_value(self, value):
+        return zlib.crc32(value.encode("utf-8")) % self.shard_count
+
+    def shard_for_rule(self, ptype, rule):
+        index = self.ptype_fields.get(ptype, self.field_index)
+        if index >= len(rule):
+            return 0
+        return self.shard_for_value(rule[index])
+
+    def shard_for_fields(self, ptype, field_index, field_values):
+        """returns the shard a field filter is confined to, or None if it spans all."""
+        index = self.ptype_fields.get(ptype, self.field_index)
+        offset = index - field_index
+        if 0 <= offset < len(field_values) and field_values[offset] != "":
+            return self.shard_for_value(field_values[offset])
+        return None
+
+    def shards_for_filter(self, filter):
+        """returns the shards a Filter can match, or None if it spans all of them."""
+        ptypes = list(getattr(filter, "ptype", None) or [])
+        if ptypes:
+            indexes = {
+                self.ptype_fields.get(ptype, self.field_index) for ptype in ptypes
+            }
+        else:
+            indexes = {self.field_index, *self.ptype_fields.values()}
+        shards = set()
+        for index in indexes:
+            values = getattr(filter, "v{}".format(index), None) or []
+            if not values:
+                return None
+            shards.update(self.shard_for_value(value) for value in values)
+        return shards
+
+
+class ShardedAdapter(AsyncAdapter):
+    """spreads the policy over several Adapters, one per shard.
+
+    Each shard is a regular Adapter with its own engine or table. Writes are
+    routed with router.shard_for_rule(ptype, rule), filtered loads only query the
+    shards router.shards_for_filter(filter) selects, and full loads read every
+    shard concurrently and apply the rows in shard order. Writes that span
+    shards are not atomic across them. With intern_values=True equal field
+    values of one load share a single string object.
+    """
+
+    def __init__(self, shards, router, filtered=False, intern_values=False):
+        if not shards:
+            raise ValueError("at least one shard is required.")
+        self.shards = list(shards)
+        self.router = router
+        self._filtered = filtered
+        self._intern_values = intern_values
+
+    def _group(self, ptype, rules):
+        groups = {}
+        for rule in rules:
+            groups.setdefault(self.router.shard_for_rule(ptype, rule), []).append(rule)
+        return groups
+
+    async def _read(self, shard, filter=None):
+        await shard.flush()
+        return await shard._select_rows(filter)
+
+    async def load_policy(self, model):
+        """loads all policy rules from every shard concurrently."""
+        results = await asyncio.gather(*(self._read(shard) for shard in self.shards))
+        values = {} if self._intern_values else None
+        for rows in results:
+            Adapter._load_policy_rows(rows, model, values)
+
+    def is_filtered(self):
+        return self._filtered
+
+    async def load_filtered_policy(self, model, filter) -> None:
+        """loads the policy rules matching the filter from the shards it selects."""
+        indexes = self.router.shards_for_filter(filter)
+        if indexes is None:
+            indexes = range(len(self.shards))
+        results = await asyncio.gather(
+            *(self._read(self.shards[i], filter) for i in sorted(indexes))
+        )
+        values = {} if self._intern_values else None
+        for rows in results:
+            Adapter._load_policy_rows(rows, model, values)
+        self._filtered = True
+
+    async def save_policy(self, model):
+        """replaces the rules of every shard with the model's rules for that shard."""
+        groups = [[] for _ in self.shards]
+        for ptype, rule in Adapter._model_rules(model):
+            groups[self.router.shard_for_rule(ptype, rule)].append((ptype, rule))
+        await asyncio.gather(
+            *(shard._replace_rules(rules) for shard, rules in zip(self.shards, groups))
+        )
+        return True
+
+    async def add_policy(self, sec, ptype, rule):
+        """adds a policy rule to its shard."""
+        shard = self.shards[self.router.shard_for_rule(ptype, rule)]
+        return await shard.add_policy(sec, ptype, rule)
+
+    async def add_policies(self, sec, ptype, rules):
+        """adds policy rules, one batch per shard, and returns the stored count."""
+        counts = await asyncio.gather(
+            *(
+                self.shards[i].add_policies(sec, ptype, group)
+                for i, group in self._group(ptype, rules).items()
+            )
+        )
+        return sum(count or 0 for count in counts)
+
+    async def remove_policy(self, sec, ptype, rule):
+        """removes a policy rule from its shard."""
+        shard = self.shards[self.router.shard_for_rule(ptype, rule)]
+        return await shard.remove_policy(sec, ptype, rule)
+
+    async def remove_policies(self, sec, ptype, rules):
+        """removes policy rules, one batch per shard, and returns the deleted count."""
+        counts = await asyncio.gather(
+            *(
+                self.shards[i].remove_policies(sec, ptype, group)
+                for i, group in self._group(ptype, rules).items()
+            )
+        )
+        return sum(counts)
+
+    def _shards_for_fields(self, ptype, field_index, field_values):
+        index = self.router.shard_for_fields(ptype, field_index, field_values)
+        return self.shards if index is None else [self.shards[index]]
+
+    async def remove_filtered_policy(self, sec, ptype, field_index, *field_values):
+        """removes the matching rules from the shards the filter can reach."""
+        results = await asyncio.gather(
+            *(
+                shard.remove_filtered_policy(sec, ptype, field_index, *field_values)
+                for shard in self._shards_for_fields(ptype, field_index, field_values)
+            )
+        )
+        return any(results)
+
+    async def update_policy(
+        self, sec: str, ptype: str, old_rule: List[str], new_rule: List[str]
+    ) -> None:
+        """updates a rule in place, or moves it when the new rule lives on another shard."""
+        await self.update_policies(sec, ptype, [old_rule], [new_rule])
+
+    async def update_policies(
+        self,
+        sec: str,
+        ptype: str,
+        old_rules: List[List[str]],
+        new_rules: List[List[str]],
+    ) -> None:
+        """updates rules within their shard and moves the ones that change shard."""
+        updates = {}
+        moves = []
+        for old_rule, new_rule in zip(old_rules, new_rules):
+            old_shard = self.router.shard_for_rule(ptype, old_rule)
+            if old_shard == self.router.shard_for_rule(ptype, new_rule):
+                olds, news = updates.setdefault(old_shard, ([], []))
+                olds.append(old_rule)
+                news.append(new_rule)
+            else:
+                moves.append((old_rule, new_rule))
+
+        await asyncio.gather(
+            *(
+                self.shards[i].update_policies(sec, ptype, olds, news)
+                for i, (olds, news) in updates.items()
+            )
+        )
+        if moves:
+            await self.remove_policies(sec, ptype, [old for old, _ in moves])
+            await self.add_policies(sec, ptype, [new for _, new in moves])
+
+    async def update_filtered_policies(
+        self, sec, ptype, new_rules: List[List[str]], field_index, *field_values
+    ) -> List[List[str]]:
+        """replaces the rules matching the filter and returns the removed ones."""
+        results = await asyncio.gather(
+            *(
+                shard.update_filtered_policies(
+                    sec, ptype, [], field_index, *field_values
+                )
+                for shard in self._shards_for_fields(ptype, field_index, field_values)
+            )
+        )
+        await self.add_policies(sec, ptype, new_rules)
+        return [rule for rules in results for rule in rules]
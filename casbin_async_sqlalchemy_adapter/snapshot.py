@@ -0,0 +1,165 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b"CBPS"
+FORMAT_VERSION = 1
+
+# magic, format version, reserved, policy version (-1 for none), strings, rows
+_HEADER = struct.Struct("<4sHHqII")
+
+# ptype, v0, ..., v5
+COLUMNS = 7
+
+NO_VALUE = -1
+
+
+def _little_endian(values):
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def write_snapshot(path, rows, version=None):
+    """writes (ptype, v0, ..., v5) rows to a columnar snapshot file.
+
+    Every distinct value is stored once in a string table, and each column is an
+    int32 array of string indexes, NO_VALUE for NULL. The file is written next to
+    path and renamed into place, so readers never see a partial snapshot.
+    """
+    strings = {}
+    columns = [array("i") for _ in range(COLUMNS)]
+    for row in rows:
+        for column, value in zip(columns, row):
+            if value is None:
+                column.append(NO_VALUE)
+            else:
+                column.append(strings.setdefault(value, len(strings)))
+
+    offsets = array("I", [0])
+    blob = bytearray()
+    for value in strings:
+        blob += value.encode("utf-8")
+        offsets.append(len(blob))
+    # keep the int32 columns 4-byte aligned
+    blob += b"\0" * (-len(blob) % 4)
+
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "wb") as f:
+        f.write(
+            _HEADER.pack(
+                MAGIC,
+                FORMAT_VERSION,
+                0,
+                NO_VALUE if version is None else version,
+                len(strings),
+                len(columns[0]),
+            )
+        )
+        f.write(_little_endian(offsets).tobytes())
+        f.write(blob)
+        for column in columns:
+            f.write(_little_endian(column).tobytes())
+    os.replace(tmp_path, path)
+
+
+class PolicySnapshot:
+    """a memory-mapped snapshot written by write_snapshot.
+
+    Only the string table is decoded up front, rows are built from the mapped
+    columns as they are read. Use it as a context manager, or call close().
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._open(path)
+        except Exception:
+            self._mmap.close()
+            raise
+
+    def _open(self, path):
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError("{} is not a policy snapshot.".format(path))
+        magic, format_version, _, version, string_count, row_count = (
+            _HEADER.unpack_from(self._mmap)
+        )
+        if magic != MAGIC:
+            raise ValueError("{} is not a policy snapshot.".format(path))
+        if format_version != FORMAT_VERSION:
+            raise ValueError(
+                "unsupported policy snapshot format {}.".format(format_version)
+            )
+        self.version = None if version == NO_VALUE else version
+        self.row_count = row_count
+
+        position = _HEADER.size
+        if position + 4 * (string_count + 1) > len(self._mmap):
+            raise ValueError("{} is truncated.".format(path))
+        offsets = self._array("I", position, string_count + 1).tolist()
+        position += 4 * (string_count + 1)
+        blob = self._mmap[position : position + offsets[-1]]
+        position += offsets[-1] + (-offsets[-1] % 4)
+        if position + 4 * COLUMNS * row_count > len(self._mmap):
+            raise ValueError("{} is truncated.".format(path))
+        self.strings = [
+            blob[offsets[i] : offsets[i + 1]].decode("utf-8")
+            for i in range(string_count)
+        ]
+        self._columns = []
+        for _ in range(COLUMNS):
+            self._columns.append(self._array("i", position, row_count))
+            position += 4 * row_count
+
+    def _array(self, typecode, position, count):
+        if sys.byteorder == "little":
+            return memoryview(self._mmap)[position : position + 4 * count].cast(
+                typecode
+            )
+        values = array(typecode, self._mmap[position : position + 4 * count])
+        values.byteswap()
+        return values
+
+    def __len__(self):
+        return self.row_count
+
+    def partitions(self, size):
+        """yields lists of up to size (ptype, v0, ..., v5) row tuples."""
+        strings = self.strings
+        for start in range(0, self.row_count, size):
+            stop = min(start + size, self.row_count)
+            columns = [column[start:stop].tolist() for column in self._columns]
+            yield [
+                tuple(None if i == NO_VALUE else strings[i] for i in indexes)
+                for indexes in zip(*columns)
+            ]
+
+    def close(self):
+        for column in self._columns:
+            if isinstance(column, memoryview):
+                column.release()
+        self._columns = []
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,230 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import json
+import logging
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY payloads must stay below 8000 bytes
+MAX_NOTIFY_PAYLOAD = 7900
+
+
+class ChangeEvent:
+    """one committed policy change: op is "add", "remove" or "reset".
+
+    A reset is a save_policy, its rules are empty and listeners reload in full.
+    """
+
+    __slots__ = ("op", "ptype", "rules")
+
+    def __init__(self, op, ptype, rules):
+        self.op = op
+        self.ptype = ptype
+        self.rules = rules
+
+    def __repr__(self):
+        return "<ChangeEvent {} {} {} rules>".format(
+            self.op, self.ptype, len(self.rules)
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, ChangeEvent) and (
+            self.op,
+            self.ptype,
+            self.rules,
+        ) == (other.op, other.ptype, other.rules)
+
+    def to_list(self):
+        return [self.op, self.ptype, self.rules]
+
+    @classmethod
+    def from_list(cls, value):
+        op, ptype, rules = value
+        return cls(op, ptype, rules)
+
+
+def apply_change(model, op, ptype, rule):
+    """applies one added or removed rule to the model, idempotently."""
+    sec = ptype[:1]
+    if sec not in model.model.keys() or ptype not in model.model[sec].keys():
+        return
+    if op == "add":
+        model.add_policy(sec, ptype, rule)
+    elif op == "remove":
+        model.remove_policy(sec, ptype, rule)
+
+
+class ChangePublisher:
+    """base class for publishers, the adapter awaits publish(events) after each commit."""
+
+    def attach(self, adapter):
+        pass
+
+    async def publish(self, events):
+        pass
+
+
+class _Listener:
+    def __init__(self, adapter, model, on_change=None):
+        self.adapter = adapter
+        self.model = model
+        self.on_change = on_change
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    async def _reload(self):
+        self.model.clear_policy()
+        await self.adapter.load_policy(self.model, use_primary=True)
+        self._changed()
+
+
+class TableChangeListener(_Listener):
+    """keeps a model current by polling the adapter's change log.
+
+    Works with any engine, the adapter needs changelog=True. Every interval
+    seconds the changes logged since the last poll are applied with
+    load_policy_delta, then on_change() is called, e.g. the enforcer's
+    build_role_links. version is the change log version the model was loaded
+    at, the current one when None.
+    """
+
+    def __init__(self, adapter, model, interval=1.0, version=None, on_change=None):
+        super().__init__(adapter, model, on_change)
+        self.interval = interval
+        self.version = version
+        self._task = None
+
+    async def poll(self):
+        """applies the pending changes now, returns whether there were any."""
+        if self.version is None:
+            self.version = await self.adapter.get_version()
+            return False
+        version = await self.adapter.load_policy_delta(self.model, self.version)
+        if version == self.version:
+            return False
+        self.version = version
+        self._changed()
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                logger.warning("polling the policy change log failed", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        if self.version is None:
+            self.version = await self.adapter.get_version()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def encode_events(events):
+    """encodes events as a NOTIFY payload, or a reload marker when they are too large."""
+    payload = json.dumps(
+        {"changes": [event.to_list() for event in events]}, separators=(",", ":")
+    )
+    if len(payload.encode("utf-8")) > MAX_NOTIFY_PAYLOAD:
+        return json.dumps({"reload": True})
+    return payload
+
+
+def decode_events(payload):
+    """returns the events of a payload, or None when listeners must reload."""
+    message = json.loads(payload)
+    if message.get("reload"):
+        return None
+    return [ChangeEvent.from_list(change) for change in message["changes"]]
+
+
+class PostgresNotifyPublisher(ChangePublisher):
+    """publishes committed changes with PostgreSQL's pg_notify on channel."""
+
+    def __init__(self, channel="casbin_policy"):
+        self.channel = channel
+        self._adapter = None
+
+    def attach(self, adapter):
+        self._adapter = adapter
+
+    async def publish(self, events):
+        async with self._adapter._engine.connect() as conn:
+            await conn.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": self.channel, "payload": encode_events(events)},
+            )
+            await conn.commit()
+
+
+class PostgresNotifyListener(_Listener):
+    """applies the changes a PostgresNotifyPublisher sends, as they are committed.
+
+    Needs the asyncpg driver. The listener holds one connection of the adapter's
+    engine while it runs. Changes that did not fit in a notification, and saves,
+    make it reload the model in full.
+    """
+
+    def __init__(self, adapter, model, channel="casbin_policy", on_change=None):
+        super().__init__(adapter, model, on_change)
+        self.channel = channel
+        self._conn = None
+        self._driver = None
+        self._reloads = set()
+
+    async def start(self):
+        if self.adapter._engine.dialect.driver != "asyncpg":
+            raise RuntimeError("PostgresNotifyListener requires the asyncpg driver.")
+        self._conn = await self.adapter._engine.connect()
+        raw = await self._conn.get_raw_connection()
+        self._driver = raw.driver_connection
+        await self._driver.add_listener(self.channel, self._notify)
+
+    def _notify(self, connection, pid, channel, payload):
+        self.handle(payload)
+
+    def handle(self, payload):
+        """applies one notification payload to the model."""
+        events = decode_events(payload)
+        if events is None or any(event.op == "reset" for event in events):
+            task = asyncio.ensure_future(self._reload())
+            self._reloads.add(task)
+            task.add_done_callback(self._reloads.discard)
+            return
+        for event in events:
+            for rule in event.rules:
+                apply_change(self.model, event.op, event.ptype, rule)
+        self._changed()
+
+    async def stop(self):
+        if self._driver is not None:
+            await self._driver.remove_listener(self.channel, self._notify)
+            self._driver = None
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
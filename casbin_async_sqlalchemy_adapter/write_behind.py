@@ -0,0 +1,204 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import logging
+
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+from .instrumentation import detach
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """queues auto-save writes and commits them in batches.
+
+    add/remove/update calls return as soon as the change is queued. Changes are
+    coalesced, an add followed by a remove of the same rule cancels out and an
+    update of a still-queued add replaces that add, as long as no other queued
+    change touches the rule. The queue is flushed in one transaction once
+    max_batch changes are pending or max_delay seconds after the first one. When
+    max_pending changes are waiting, callers block until a flush has made room.
+
+    A flush that fails on a connection or operational error keeps its changes
+    queued, flush() retries them and raises if they still cannot be committed.
+    Any other error means some change can never be committed, e.g. an update
+    of a missing rule. The batch is then committed change by change, and the
+    changes that fail are dropped, logged and passed to on_error(op, ptype,
+    rule, new_rule, error).
+    """
+
+    def __init__(self, max_batch=500, max_delay=0.05, max_pending=10000, on_error=None):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.on_error = on_error
+        self._adapter = None
+        self._pending = []
+        self._adds = {}
+        self._lock = asyncio.Lock()
+        self._timer = None
+        self._closed = False
+
+    def attach(self, adapter):
+        if self._adapter is not None and self._adapter is not adapter:
+            raise RuntimeError(
+                "the write-behind queue is already attached to an adapter."
+            )
+        self._adapter = adapter
+
+    def __len__(self):
+        return sum(1 for change in self._pending if change is not None)
+
+    async def add(self, ptype, rules):
+        for rule in rules:
+            await self._submit(["add", ptype, list(rule), None])
+
+    async def remove(self, ptype, rules):
+        for rule in rules:
+            key = (ptype, tuple(rule))
+            queued = self._adds.pop(key, None)
+            if queued is not None:
+                # the rule never reached the database
+                self._pending[queued] = None
+                continue
+            await self._submit(["remove", ptype, list(rule), None])
+
+    async def update(self, ptype, old_rules, new_rules):
+        for old_rule, new_rule in zip(old_rules, new_rules):
+            queued = self._adds.pop((ptype, tuple(old_rule)), None)
+            if queued is not None:
+                # the old rule never reached the database, add the new one instead
+                self._pending[queued] = None
+                await self._submit(["add", ptype, list(new_rule), None])
+                continue
+            await self._submit(["update", ptype, list(old_rule), list(new_rule)])
+
+    async def _submit(self, change):
+        if self._closed:
+            raise RuntimeError("the write-behind queue is closed.")
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+        op, ptype, rule, new_rule = change
+        key = (ptype, tuple(rule))
+        if op == "add" and key not in self._adds:
+            self._adds[key] = len(self._pending)
+        else:
+            # an add is only cancelled while no later change touches its rule
+            self._adds.pop(key, None)
+            if new_rule is not None:
+                self._adds.pop((ptype, tuple(new_rule)), None)
+        self._pending.append(change)
+        if len(self._pending) >= self.max_batch:
+            self._schedule(0)
+        elif self._timer is None:
+            self._schedule(self.max_delay)
+
+    def _schedule(self, delay):
+        if self._timer is not None and not self._timer.done():
+            if delay > 0:
+                return
+            self._timer.cancel()
+        self._timer = asyncio.ensure_future(self._flush_later(delay))
+
+    async def _flush_later(self, delay):
+        # the timer task inherits the context of the call that scheduled it
+        detach()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception:
+            # the changes stay queued for the next flush
+            pass
+
+    async def flush(self):
+        """commits everything queued so far."""
+        async with self._lock:
+            changes = [change for change in self._pending if change is not None]
+            self._pending = []
+            self._adds = {}
+            if not changes:
+                return
+            try:
+                await self._commit(changes)
+                return
+            except Exception as e:
+                if self._transient(e):
+                    self._requeue(changes)
+                    raise
+                logger.warning(
+                    "write-behind flush failed, committing %d changes one by one",
+                    len(changes),
+                )
+            for i, change in enumerate(changes):
+                try:
+                    await self._commit([change])
+                except Exception as e:
+                    if self._transient(e):
+                        self._requeue(changes[i:])
+                        raise
+                    self._reject(change, e)
+
+    @staticmethod
+    def _transient(error):
+        """whether a failed flush can succeed when retried."""
+        if isinstance(error, DBAPIError) and error.connection_invalidated:
+            return True
+        return isinstance(
+            error,
+            (OperationalError, InterfaceError, ConnectionError, asyncio.TimeoutError),
+        )
+
+    def _requeue(self, changes):
+        logger.warning("write-behind flush failed, keeping %d changes", len(changes))
+        self._pending = changes + self._pending
+        self._adds = {}
+
+    def _reject(self, change, error):
+        logger.error("dropping write-behind change %s: %s", change, error)
+        if self.on_error is not None:
+            self.on_error(*change, error)
+
+    async def _commit(self, changes):
+        async with self._adapter._write_scope() as session:
+            for op, ptype, rules, new_rules in self._runs(changes):
+                if op == "add":
+                    await self._adapter._add_rules(session, ptype, rules)
+                elif op == "remove":
+                    await self._adapter._remove_rules(session, ptype, rules)
+                else:
+                    await self._adapter._update_rules(session, ptype, rules, new_rules)
+
+    @staticmethod
+    def _runs(changes):
+        """groups consecutive changes with the same op and ptype, keeping their order."""
+        runs = []
+        for op, ptype, rule, new_rule in changes:
+            if runs and runs[-1][0] == op and runs[-1][1] == ptype:
+                runs[-1][2].append(rule)
+                if new_rule is not None:
+                    runs[-1][3].append(new_rule)
+            else:
+                runs.append((op, ptype, [rule], [] if new_rule is None else [new_rule]))
+        return runs
+
+    async def aclose(self):
+        """flushes the queue and stops accepting changes."""
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
@@ -46,7 +46,7 @@ setup(
         "acl",
         "permission",
     ],
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*", "tests"]),
     install_requires=install_requires,
     python_requires=">=3.7",
     license="Apache 2.0",
@@ -0,0 +1,141 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import unittest
+from unittest import IsolatedAsyncioTestCase
+from unittest import mock
+
+import casbin
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from casbin_async_sqlalchemy_adapter import Adapter
+from casbin_async_sqlalchemy_adapter import PolicyCache
+from casbin_async_sqlalchemy_adapter.adapter import Filter
+from casbin_async_sqlalchemy_adapter.cache import FULL_POLICY, filter_key
+
+
+def get_fixture(path):
+    dir_path = os.path.split(os.path.realpath(__file__))[0] + "/"
+    return os.path.abspath(dir_path + path)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPolicyCache(IsolatedAsyncioTestCase):
+    def test_filter_key(self):
+        a = Filter()
+        a.ptype = ["p"]
+        a.v1 = ["domain2", "domain1", "domain2"]
+        b = Filter()
+        b.ptype = ["p"]
+        b.v1 = ["domain1", "domain2"]
+        self.assertEqual(filter_key(a), filter_key(b))
+        self.assertEqual(filter_key(None), FULL_POLICY)
+        self.assertNotEqual(filter_key(Filter()), FULL_POLICY)
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = PolicyCache(ttl=10, clock=clock)
+        cache.put("full", [("p", "alice")])
+        clock.now = 9
+        self.assertEqual(cache.get("full"), (("p", "alice"),))
+        clock.now = 10
+        self.assertIsNone(cache.get("full"))
+
+    def test_lru_by_rows(self):
+        cache = PolicyCache(max_rows=3)
+        cache.put("a", [("p", "1"), ("p", "2")])
+        cache.put("b", [("p", "3")])
+        cache.get("a")
+        cache.put("c", [("p", "4")])
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("d", [("p", str(i)) for i in range(4)])
+        self.assertIsNone(cache.get("d"))
+
+    async def test_shared_in_flight_load(self):
+        cache = PolicyCache()
+        calls = []
+        release = asyncio.Event()
+
+        async def loader():
+            calls.append(1)
+            await release.wait()
+            return [("p", "alice")]
+
+        waiters = [
+            asyncio.ensure_future(cache.get_or_load("full", loader)) for _ in range(5)
+        ]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [(("p", "alice"),)] * 5)
+
+    async def test_invalidate_during_load(self):
+        cache = PolicyCache()
+        release = asyncio.Event()
+
+        async def loader():
+            await release.wait()
+            return [("p", "stale")]
+
+        waiter = asyncio.ensure_future(cache.get_or_load("full", loader))
+        await asyncio.sleep(0)
+        cache.invalidate()
+        release.set()
+        await waiter
+        self.assertIsNone(cache.get("full"))
+
+    async def test_adapter_read_through(self):
+        engine = create_async_engine("sqlite+aiosqlite://", future=True)
+        adapter = Adapter(engine, cache=PolicyCache(), warning=False)
+        await adapter.create_table()
+        await adapter.add_policy("p", "p", ["alice", "data1", "read"])
+
+        e = casbin.AsyncEnforcer(get_fixture("rbac_model.conf"), adapter)
+        with mock.patch.object(
+            adapter, "_select_rows", wraps=adapter._select_rows
+        ) as select_rows:
+            await e.load_policy()
+            await e.load_policy()
+            self.assertEqual(select_rows.call_count, 1)
+            self.assertEqual(e.get_policy(), [["alice", "data1", "read"]])
+
+            await adapter.add_policy("p", "p", ["bob", "data2", "write"])
+            await e.load_policy()
+            self.assertEqual(select_rows.call_count, 2)
+            self.assertEqual(
+                e.get_policy(), [["alice", "data1", "read"], ["bob", "data2", "write"]]
+            )
+
+            adapter.invalidate()
+            filter = Filter()
+            filter.v0 = ["bob"]
+            await e.load_filtered_policy(filter)
+            await e.load_filtered_policy(filter)
+            self.assertEqual(select_rows.call_count, 3)
+            self.assertEqual(e.get_policy(), [["bob", "data2", "write"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
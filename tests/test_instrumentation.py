@@ -0,0 +1,258 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib.util
+import os
+import types
+import unittest
+from unittest import IsolatedAsyncioTestCase
+from unittest import mock
+
+import casbin
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from casbin_async_sqlalchemy_adapter import Adapter, AdapterObserver, WriteBehindQueue
+from casbin_async_sqlalchemy_adapter import OpenTelemetryObserver, PrometheusObserver
+
+
+def get_fixture(path):
+    dir_path = os.path.split(os.path.realpath(__file__))[0] + "/"
+    return os.path.abspath(dir_path + path)
+
+
+class RecordingObserver(AdapterObserver):
+    def __init__(self):
+        self.events = []
+
+    def on_operation(self, event):
+        self.events.append(event)
+
+
+class StubSpan:
+    def __init__(self, name, start_time):
+        self.name = name
+        self.start_time = start_time
+        self.end_time = None
+        self.attributes = {}
+        self.exceptions = []
+        self.status = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, error):
+        self.exceptions.append(error)
+
+    def set_status(self, status):
+        self.status = status
+
+    def end(self, end_time=None):
+        self.end_time = end_time
+
+
+class StubTracer:
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, name, start_time=None):
+        span = StubSpan(name, start_time)
+        self.spans.append(span)
+        return span
+
+
+def stub_opentelemetry():
+    """an opentelemetry package with just what OpenTelemetryObserver uses."""
+    trace = types.ModuleType("opentelemetry.trace")
+    trace.StatusCode = types.SimpleNamespace(ERROR="ERROR")
+    trace.Status = lambda code: ("status", code)
+    trace.get_tracer = lambda name: StubTracer()
+    package = types.ModuleType("opentelemetry")
+    package.trace = trace
+    return {"opentelemetry": package, "opentelemetry.trace": trace}
+
+
+class StubRegistry:
+    def __init__(self):
+        self.metrics = []
+
+
+class StubMetric:
+    def __init__(self, name, documentation, labels, namespace, registry):
+        self.name = "{}_{}".format(namespace, name)
+        self.labelnames = labels
+        self.samples = {}
+        registry.metrics.append(self)
+
+    def labels(self, *values):
+        self._key = values
+        return self
+
+    def inc(self, amount=1):
+        self.samples[self._key] = self.samples.get(self._key, 0) + amount
+
+    def observe(self, value):
+        self.samples.setdefault(self._key, []).append(value)
+
+
+def stub_prometheus_client():
+    """a prometheus_client module whose metrics register in a plain list."""
+    module = types.ModuleType("prometheus_client")
+    module.REGISTRY = StubRegistry()
+    module.Counter = StubMetric
+    module.Histogram = StubMetric
+    return {"prometheus_client": module}
+
+
+async def new_adapter(**kwargs):
+    engine = create_async_engine("sqlite+aiosqlite://", future=True)
+    adapter = Adapter(engine, warning=False, **kwargs)
+    await adapter.create_table()
+    return adapter
+
+
+class TestInstrumentation(IsolatedAsyncioTestCase):
+    async def test_operation_events(self):
+        observer = RecordingObserver()
+        adapter = await new_adapter(observers=[observer])
+        await adapter.add_policies(
+            "p", "p", [["alice", "data1", "read"], ["bob", "data2", "write"]]
+        )
+        await adapter.remove_filtered_policy("p", "p", 0, "bob")
+
+        e = casbin.AsyncEnforcer(get_fixture("rbac_model.conf"), adapter)
+        await e.load_policy()
+
+        methods = [event.method for event in observer.events]
+        self.assertEqual(
+            methods,
+            ["create_table", "add_policies", "remove_filtered_policy", "load_policy"],
+        )
+        add, remove, load = observer.events[1:]
+        self.assertEqual(
+            (add.rows_written, add.statements, add.outcome), (2, 1, "commit")
+        )
+        self.assertEqual(remove.rows_written, 1)
+        self.assertEqual((load.rows_read, load.rows_written), (1, 0))
+        self.assertGreaterEqual(load.duration, 0)
+        self.assertIsNone(load.error)
+
+    async def test_rollback_outcome(self):
+        observer = RecordingObserver()
+        adapter = await new_adapter(observers=[observer])
+        with self.assertRaises(ValueError):
+            await adapter.update_policies(
+                "p", "p", [["nobody", "data1", "read"]], [["alice", "data1", "read"]]
+            )
+        event = observer.events[-1]
+        self.assertEqual(event.method, "update_policies")
+        self.assertEqual(event.outcome, "rollback")
+        self.assertIsInstance(event.error, ValueError)
+
+    async def test_nested_calls_fold_into_outer_event(self):
+        observer = RecordingObserver()
+        queue = WriteBehindQueue(max_delay=60)
+        adapter = await new_adapter(observers=[observer], write_behind=queue)
+        await adapter.add_policy("p", "p", ["alice", "data1", "read"])
+        observer.events.clear()
+
+        # load_policy flushes the queue before it reads
+        await adapter.load_policy(
+            casbin.Enforcer(get_fixture("rbac_model.conf")).get_model()
+        )
+        self.assertEqual([event.method for event in observer.events], ["load_policy"])
+        self.assertEqual(observer.events[0].rows_written, 1)
+        self.assertEqual(observer.events[0].rows_read, 1)
+        await adapter.aclose()
+
+    async def test_disabled_by_default(self):
+        adapter = await new_adapter()
+        await adapter.add_policy("p", "p", ["alice", "data1", "read"])
+        self.assertEqual(adapter._observers, [])
+
+    async def test_opentelemetry_observer(self):
+        tracer = StubTracer()
+        with mock.patch.dict("sys.modules", stub_opentelemetry()):
+            observer = OpenTelemetryObserver(tracer=tracer)
+        adapter = await new_adapter(observers=[observer])
+        tracer.spans.clear()
+        await adapter.add_policy("p", "p", ["alice", "data1", "read"])
+        with self.assertRaises(ValueError):
+            await adapter.update_policies(
+                "p", "p", [["nobody", "data1", "read"]], [["alice", "data1", "read"]]
+            )
+
+        add, update = tracer.spans
+        self.assertEqual(add.name, "casbin.adapter.add_policy")
+        self.assertEqual(
+            add.attributes,
+            {
+                "casbin.adapter.rows_read": 0,
+                "casbin.adapter.rows_written": 1,
+                "casbin.adapter.statements": 1,
+                "casbin.adapter.outcome": "commit",
+            },
+        )
+        self.assertGreaterEqual(add.end_time, add.start_time)
+        self.assertIsNone(add.status)
+
+        self.assertEqual(update.name, "casbin.adapter.update_policies")
+        self.assertEqual(update.attributes["casbin.adapter.outcome"], "rollback")
+        self.assertIsInstance(update.exceptions[0], ValueError)
+        self.assertEqual(update.status, ("status", "ERROR"))
+
+    async def test_prometheus_observer_stub(self):
+        registry = StubRegistry()
+        with mock.patch.dict("sys.modules", stub_prometheus_client()):
+            observer = PrometheusObserver(registry=registry)
+        adapter = await new_adapter(observers=[observer])
+        await adapter.add_policy("p", "p", ["alice", "data1", "read"])
+        await adapter.add_policy("p", "p", ["bob", "data2", "read"])
+
+        metrics = {metric.name: metric for metric in registry.metrics}
+        self.assertEqual(
+            sorted(metrics),
+            [
+                "casbin_adapter_operation_duration_seconds",
+                "casbin_adapter_rows_read",
+                "casbin_adapter_rows_written",
+                "casbin_adapter_statements",
+            ],
+        )
+        key = ("add_policy", "commit")
+        for metric in registry.metrics:
+            self.assertEqual(metric.labelnames, ["method", "outcome"])
+        self.assertEqual(metrics["casbin_adapter_rows_written"].samples[key], 2)
+        self.assertEqual(metrics["casbin_adapter_rows_read"].samples[key], 0)
+        self.assertEqual(metrics["casbin_adapter_statements"].samples[key], 2)
+        durations = metrics["casbin_adapter_operation_duration_seconds"].samples[key]
+        self.assertEqual(len(durations), 2)
+
+    @unittest.skipIf(
+        importlib.util.find_spec("prometheus_client") is None,
+        "prometheus-client is not installed",
+    )
+    async def test_prometheus_observer(self):
+        from prometheus_client import CollectorRegistry
+
+        registry = CollectorRegistry()
+        adapter = await new_adapter(observers=[PrometheusObserver(registry=registry)])
+        await adapter.add_policy("p", "p", ["alice", "data1", "read"])
+        labels = {"method": "add_policy", "outcome": "commit"}
+        self.assertEqual(
+            registry.get_sample_value("casbin_adapter_rows_written_total", labels), 1
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+from unittest import IsolatedAsyncioTestCase
+from unittest import mock
+
+import casbin
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from casbin_async_sqlalchemy_adapter import Adapter
+from casbin_async_sqlalchemy_adapter.adapter import Filter
+from casbin_async_sqlalchemy_adapter.sharded import FieldRouter, ShardedAdapter
+
+
+def get_fixture(path):
+    dir_path = os.path.split(os.path.realpath(__file__))[0] + "/"
+    return os.path.abspath(dir_path + path)
+
+
+async def shard_policy(shard):
+    e = casbin.AsyncEnforcer(get_fixture("rbac_model.conf"), shard)
+    await e.load_policy()
+    return sorted(e.get_policy())
+
+
+class TestSharded(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.shards = []
+        for _ in range(2):
+            shard = Adapter(
+                create_async_engine("sqlite+aiosqlite://", future=True), warning=False
+            )
+            await shard.create_table()
+            self.shards.append(shard)
+        self.router = FieldRouter(2, field_index=1)
+        self.adapter = ShardedAdapter(self.shards, self.router)
+        # data1 and data4 hash to different shards
+        self.assertNotEqual(
+            self.router.shard_for_value("data1"), self.router.shard_for_value("data4")
+        )
+        self.data1 = self.router.shard_for_value("data1")
+        self.data4 = self.router.shard_for_value("data4")
+
+        self.e = casbin.AsyncEnforcer(get_fixture("rbac_model.conf"), self.adapter)
+        await self.e.add_policies(
+            [
+                ["alice", "data1", "read"],
+                ["bob", "data4", "write"],
+                ["data4_admin", "data4", "read"],
+            ]
+        )
+        await self.e.add_grouping_policy("alice", "data4_admin")
+
+    async def test_routing(self):
+        self.assertEqual(
+            await shard_policy(self.shards[self.data1]), [["alice", "data1", "read"]]
+        )
+        self.assertEqual(
+            await shard_policy(self.shards[self.data4]),
+            [["bob", "data4", "write"], ["data4_admin", "data4", "read"]],
+        )
+
+        await self.e.load_policy()
+        self.assertTrue(self.e.enforce("alice", "data1", "read"))
+        self.assertTrue(self.e.enforce("alice", "data4", "read"))
+        self.assertEqual(len(self.e.get_policy()), 3)
+
+    async def test_filtered_load_queries_selected_shards(self):
+        filter = Filter()
+        filter.ptype = ["p"]
+        filter.v1 = ["data4"]
+        with mock.patch.object(self.shards[self.data1], "_select_rows") as other:
+            await self.e.load_filtered_policy(filter)
+            other.assert_not_called()
+        self.assertEqual(
+            sorted(self.e.get_policy()),
+            [["bob", "data4", "write"], ["data4_admin", "data4", "read"]],
+        )
+
+        self.assertIsNone(self.router.shards_for_filter(Filter()))
+
+    async def test_update_moves_between_shards(self):
+        await self.e.update_policy(
+            ["alice", "data1", "read"], ["alice", "data4", "read"]
+        )
+        await self.e.update_policy(["bob", "data4", "write"], ["bob", "data4", "read"])
+        self.assertEqual(await shard_policy(self.shards[self.data1]), [])
+        self.assertEqual(
+            await shard_policy(self.shards[self.data4]),
+            [
+                ["alice", "data4", "read"],
+                ["bob", "data4", "read"],
+                ["data4_admin", "data4", "read"],
+            ],
+        )
+
+    async def test_remove(self):
+        await self.e.remove_filtered_policy(1, "data4")
+        self.assertEqual(await shard_policy(self.shards[self.data4]), [])
+        await self.e.remove_policies([["alice", "data1", "read"]])
+        self.assertEqual(await shard_policy(self.shards[self.data1]), [])
+
+    async def test_save_policy(self):
+        model = self.e.get_model()
+        model.clear_policy()
+        model.add_policy("p", "p", ["carol", "data1", "write"])
+        model.add_policy("p", "p", ["dave", "data4", "write"])
+        await self.adapter.save_policy(model)
+        self.assertEqual(
+            await shard_policy(self.shards[self.data1]), [["carol", "data1", "write"]]
+        )
+        self.assertEqual(
+            await shard_policy(self.shards[self.data4]), [["dave", "data4", "write"]]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
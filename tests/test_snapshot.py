@@ -0,0 +1,102 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+import casbin
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from casbin_async_sqlalchemy_adapter import Adapter, PolicySnapshot, write_snapshot
+
+
+def get_fixture(path):
+    dir_path = os.path.split(os.path.realpath(__file__))[0] + "/"
+    return os.path.abspath(dir_path + path)
+
+
+class TestSnapshot(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "policy.snapshot")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_round_trip(self):
+        rows = [
+            ("p", "alice", "data1", "read", None, None, None),
+            ("g", "alice", "data2_admin", None, None, None, None),
+            ("p", "bob", "dätä", "", None, None, None),
+        ]
+        write_snapshot(self.path, rows, version=42)
+        with PolicySnapshot(self.path) as snapshot:
+            self.assertEqual(snapshot.version, 42)
+            self.assertEqual(len(snapshot), 3)
+            self.assertEqual(len(snapshot.strings), 9)
+            self.assertEqual(
+                [row for rows in snapshot.partitions(2) for row in rows], rows
+            )
+
+        write_snapshot(self.path, [])
+        with PolicySnapshot(self.path) as snapshot:
+            self.assertIsNone(snapshot.version)
+            self.assertEqual(list(snapshot.partitions(2)), [])
+
+    def test_invalid_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a snapshot at all, just some bytes")
+        with self.assertRaises(ValueError):
+            PolicySnapshot(self.path)
+
+        write_snapshot(self.path, [("p", "alice", "data1", "read", None, None, None)])
+        with open(self.path, "rb") as f:
+            data = f.read()
+        with open(self.path, "wb") as f:
+            f.write(data[:-4])
+        with self.assertRaises(ValueError):
+            PolicySnapshot(self.path)
+
+    async def test_load_policy_from_snapshot(self):
+        engine = create_async_engine("sqlite+aiosqlite://", future=True)
+        adapter = Adapter(engine, changelog=True, warning=False)
+        await adapter.create_table()
+        await adapter.add_policies(
+            "p", "p", [["alice", "data1", "read"], ["bob", "data2", "write"]]
+        )
+        await adapter.add_policy("g", "g", ["alice", "data2_admin"])
+        version = await adapter.save_snapshot(self.path)
+        self.assertEqual(version, await adapter.get_version())
+
+        await adapter.remove_policy("p", "p", ["bob", "data2", "write"])
+
+        e = casbin.AsyncEnforcer(get_fixture("rbac_model.conf"), adapter)
+        model = e.get_model()
+        model.clear_policy()
+        self.assertEqual(
+            await adapter.load_policy_from_snapshot(model, self.path), version
+        )
+        self.assertEqual(
+            e.get_policy(), [["alice", "data1", "read"], ["bob", "data2", "write"]]
+        )
+        self.assertEqual(e.get_grouping_policy(), [["alice", "data2_admin"]])
+
+        await adapter.load_policy_delta(model, version)
+        self.assertEqual(e.get_policy(), [["alice", "data1", "read"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,202 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+import casbin
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from casbin_async_sqlalchemy_adapter import Adapter, ChangeEvent, ChangePublisher
+from casbin_async_sqlalchemy_adapter import PostgresNotifyListener, TableChangeListener
+from casbin_async_sqlalchemy_adapter.watcher import decode_events, encode_events
+
+
+def get_fixture(path):
+    dir_path = os.path.split(os.path.realpath(__file__))[0] + "/"
+    return os.path.abspath(dir_path + path)
+
+
+class RecordingPublisher(ChangePublisher):
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, events):
+        self.published.append(events)
+
+
+def new_enforcer(adapter):
+    return casbin.AsyncEnforcer(get_fixture("rbac_model.conf"), adapter)
+
+
+class TestWatcher(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", future=True)
+        self.publisher = RecordingPublisher()
+        self.adapter = Adapter(
+            self.engine, changelog=True, publisher=self.publisher, warning=False
+        )
+        await self.adapter.create_table()
+
+    async def test_publish_after_commit(self):
+        await self.adapter.add_policies(
+            "p", "p", [["alice", "data1", "read"], ["bob", "data2", "write"]]
+        )
+        await self.adapter.remove_filtered_policy("p", "p", 0, "bob")
+        self.assertEqual(
+            self.publisher.published,
+            [
+                [
+                    ChangeEvent(
+                        "add",
+                        "p",
+                        [["alice", "data1", "read"], ["bob", "data2", "write"]],
+                    )
+                ],
+                [ChangeEvent("remove", "p", [["bob", "data2", "write"]])],
+            ],
+        )
+
+        self.publisher.published.clear()
+        async with self.adapter.transaction():
+            await self.adapter.add_policy("g", "g", ["alice", "admin"])
+            await self.adapter.update_policy(
+                "p", "p", ["alice", "data1", "read"], ["alice", "data1", "write"]
+            )
+        self.assertEqual(
+            self.publisher.published,
+            [
+                [
+                    ChangeEvent("add", "g", [["alice", "admin"]]),
+                    ChangeEvent("remove", "p", [["alice", "data1", "read"]]),
+                    ChangeEvent("add", "p", [["alice", "data1", "write"]]),
+                ]
+            ],
+        )
+
+        self.publisher.published.clear()
+        with self.assertRaises(RuntimeError):
+            async with self.adapter.transaction():
+                await self.adapter.add_policy("p", "p", ["eve", "data3", "read"])
+                raise RuntimeError("abort")
+        self.assertEqual(self.publisher.published, [])
+
+    async def test_publish_stored_rules(self):
+        await self.adapter.add_policies(
+            "p",
+            "p",
+            [
+                ["alice", "data1", "read"],
+                ["alice", "data1", "read", "deny"],
+                ["bob", "data2", "read", "deny"],
+            ],
+        )
+        e = new_enforcer(self.adapter)
+        await e.load_policy()
+        listener = PostgresNotifyListener(self.adapter, e.get_model())
+
+        self.publisher.published.clear()
+        await self.adapter.remove_policy("p", "p", ["alice", "data1", "read"])
+        await self.adapter.update_policy(
+            "p", "p", ["bob", "data2", "read"], ["bob", "data2", "write"]
+        )
+        self.assertEqual(
+            self.publisher.published,
+            [
+                [ChangeEvent("remove", "p", [["alice", "data1", "read"]])],
+                [
+                    ChangeEvent("remove", "p", [["bob", "data2", "read", "deny"]]),
+                    ChangeEvent("add", "p", [["bob", "data2", "write", "deny"]]),
+                ],
+            ],
+        )
+        for events in self.publisher.published:
+            listener.handle(encode_events(events))
+        self.assertEqual(
+            e.get_policy(),
+            [["alice", "data1", "read", "deny"], ["bob", "data2", "write", "deny"]],
+        )
+
+    async def test_table_listener(self):
+        # the listener polls concurrently, so it needs its own connection
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, "policy.db")
+        engine = create_async_engine("sqlite+aiosqlite:///" + path, future=True)
+        self.addAsyncCleanup(engine.dispose)
+        writer = Adapter(engine, changelog=True, warning=False)
+        await writer.create_table()
+        await writer.add_policy("p", "p", ["alice", "data1", "read"])
+
+        adapter = Adapter(engine, changelog=True, warning=False)
+        e = new_enforcer(adapter)
+        await e.load_policy()
+        changed = []
+        listener = TableChangeListener(
+            adapter, e.get_model(), interval=0.01, on_change=lambda: changed.append(1)
+        )
+        await listener.start()
+        try:
+            await writer.add_policy("p", "p", ["bob", "data2", "write"])
+            await writer.add_policy("g", "g", ["carol", "data2_admin"])
+            await writer.remove_policy("p", "p", ["alice", "data1", "read"])
+            for _ in range(100):
+                if e.get_grouping_policy() and len(e.get_policy()) == 1:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await listener.stop()
+        self.assertTrue(changed)
+        self.assertEqual(e.get_policy(), [["bob", "data2", "write"]])
+        self.assertEqual(e.get_grouping_policy(), [["carol", "data2_admin"]])
+        self.assertFalse(await listener.poll())
+
+    async def test_notify_payload(self):
+        events = [
+            ChangeEvent("add", "p", [["alice", "data1", "read"]]),
+            ChangeEvent("remove", "g", [["bob", "admin"]]),
+        ]
+        self.assertEqual(decode_events(encode_events(events)), events)
+        large = [
+            ChangeEvent(
+                "add", "p", [["user{}".format(i), "data", "read"] for i in range(1000)]
+            )
+        ]
+        self.assertIsNone(decode_events(encode_events(large)))
+
+    async def test_notify_listener(self):
+        await self.adapter.add_policy("p", "p", ["alice", "data1", "read"])
+        e = new_enforcer(self.adapter)
+        await e.load_policy()
+        listener = PostgresNotifyListener(self.adapter, e.get_model())
+        with self.assertRaises(RuntimeError):
+            await listener.start()
+
+        listener.handle(
+            encode_events([ChangeEvent("add", "p", [["bob", "data2", "write"]])])
+        )
+        self.assertEqual(
+            e.get_policy(), [["alice", "data1", "read"], ["bob", "data2", "write"]]
+        )
+
+        listener.handle(encode_events([ChangeEvent("reset", None, [])]))
+        await asyncio.gather(*listener._reloads)
+        self.assertEqual(e.get_policy(), [["alice", "data1", "read"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
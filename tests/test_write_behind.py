@@ -0,0 +1,182 @@
+# Copyright 2023 The casbin Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import unittest
+from unittest import IsolatedAsyncioTestCase
+from unittest import mock
+
+import casbin
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from casbin_async_sqlalchemy_adapter import Adapter
+from casbin_async_sqlalchemy_adapter import WriteBehindQueue
+
+
+def get_fixture(path):
+    dir_path = os.path.split(os.path.realpath(__file__))[0] + "/"
+    return os.path.abspath(dir_path + path)
+
+
+async def stored_policy(engine):
+    reader = Adapter(engine, warning=False)
+    e = casbin.AsyncEnforcer(get_fixture("rbac_model.conf"), reader)
+    await e.load_policy()
+    return e.get_policy()
+
+
+class TestWriteBehind(IsolatedAsyncioTestCase):
+    async def get_adapter(self, **kwargs):
+        engine = create_async_engine("sqlite+aiosqlite://", future=True)
+        queue = WriteBehindQueue(**kwargs)
+        adapter = Adapter(engine, warning=False, write_behind=queue)
+        await adapter.create_table()
+        return engine, adapter, queue
+
+    async def test_flush(self):
+        engine, adapter, queue = await self.get_adapter(max_delay=60)
+        await adapter.add_policy("p", "p", ["alice", "data1", "read"])
+        await adapter.add_policies(
+            "p", "p", [["bob", "data2", "write"], ["carol", "data3", "read"]]
+        )
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(await stored_policy(engine), [])
+
+        with mock.patch.object(
+            adapter, "_write_scope", wraps=adapter._write_scope
+        ) as write_scope:
+            await adapter.flush()
+            self.assertEqual(write_scope.call_count, 1)
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(
+            await stored_policy(engine),
+            [
+                ["alice", "data1", "read"],
+                ["bob", "data2", "write"],
+                ["carol", "data3", "read"],
+            ],
+        )
+
+        await adapter.update_policy(
+            "p", "p", ["bob", "data2", "write"], ["bob", "data2", "read"]
+        )
+        await adapter.remove_policy("p", "p", ["carol", "data3", "read"])
+        await adapter.aclose()
+        self.assertEqual(
+            await stored_policy(engine),
+            [["alice", "data1", "read"], ["bob", "data2", "read"]],
+        )
+        with self.assertRaises(RuntimeError):
+            await adapter.add_policy("p", "p", ["dave", "data4", "read"])
+
+    async def test_coalesce(self):
+        engine, adapter, queue = await self.get_adapter(max_delay=60)
+        await adapter.add_policy("p", "p", ["alice", "data1", "read"])
+        await adapter.remove_policy("p", "p", ["alice", "data1", "read"])
+        await adapter.add_policy("p", "p", ["bob", "data2", "read"])
+        await adapter.update_policy(
+            "p", "p", ["bob", "data2", "read"], ["bob", "data2", "write"]
+        )
+        self.assertEqual(len(queue), 1)
+        await adapter.flush()
+        self.assertEqual(await stored_policy(engine), [["bob", "data2", "write"]])
+
+    async def test_coalesce_keeps_order(self):
+        engine, adapter, queue = await self.get_adapter(max_delay=60)
+        await adapter.add_policy("p", "p", ["alice", "data1", "read"])
+        await adapter.flush()
+        # the update also produces the rule, so the remove must not cancel the add
+        await adapter.add_policy("p", "p", ["bob", "data2", "read"])
+        await adapter.update_policy(
+            "p", "p", ["alice", "data1", "read"], ["bob", "data2", "read"]
+        )
+        await adapter.remove_policy("p", "p", ["bob", "data2", "read"])
+        self.assertEqual(len(queue), 3)
+        await adapter.flush()
+        self.assertEqual(await stored_policy(engine), [])
+
+    async def test_remove_matches_direct_remove(self):
+        rules = [["alice", "data1", "read"], ["alice", "data1", "read", "deny"]]
+        for write_behind in (True, False):
+            engine, adapter, queue = await self.get_adapter(max_delay=60)
+            if not write_behind:
+                adapter._write_behind = None
+            await adapter.add_policies("p", "p", rules)
+            await adapter.flush()
+            await adapter.remove_policy("p", "p", ["alice", "data1", "read"])
+            await adapter.flush()
+            self.assertEqual(await stored_policy(engine), rules[1:])
+
+    async def test_thresholds(self):
+        engine, adapter, queue = await self.get_adapter(
+            max_batch=2, max_delay=0.01, max_pending=4
+        )
+        await adapter.add_policy("p", "p", ["alice", "data1", "read"])
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(await stored_policy(engine), [["alice", "data1", "read"]])
+
+        with mock.patch.object(queue, "_schedule"):
+            await adapter.add_policies(
+                "p", "p", [["user{}".format(i), "data", "read"] for i in range(6)]
+            )
+            self.assertLessEqual(len(queue), 4)
+        await adapter.flush()
+        self.assertEqual(len(await stored_policy(engine)), 7)
+
+    async def test_failed_flush_keeps_changes(self):
+        engine, adapter, queue = await self.get_adapter(max_delay=60)
+        await adapter.add_policy("p", "p", ["alice", "data1", "read"])
+        error = OperationalError("INSERT", {}, Exception("down"))
+        with mock.patch.object(adapter, "_add_rules", side_effect=error):
+            with self.assertRaises(OperationalError):
+                await adapter.flush()
+        self.assertEqual(len(queue), 1)
+        await adapter.flush()
+        self.assertEqual(await stored_policy(engine), [["alice", "data1", "read"]])
+
+    async def test_failed_change_is_dropped(self):
+        errors = []
+        engine, adapter, queue = await self.get_adapter(
+            max_delay=60, on_error=lambda *args: errors.append(args)
+        )
+        await adapter.update_policy(
+            "p", "p", ["nobody", "data1", "read"], ["nobody", "data1", "write"]
+        )
+        await adapter.add_policy("p", "p", ["alice", "data1", "read"])
+        await adapter.flush()
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(await stored_policy(engine), [["alice", "data1", "read"]])
+        self.assertEqual(len(errors), 1)
+        op, ptype, rule, new_rule, error = errors[0]
+        self.assertEqual((op, rule), ("update", ["nobody", "data1", "read"]))
+        self.assertIsInstance(error, ValueError)
+
+        # loads flush first and keep working
+        e = casbin.AsyncEnforcer(get_fixture("rbac_model.conf"), adapter)
+        await e.load_policy()
+        self.assertEqual(e.get_policy(), [["alice", "data1", "read"]])
+
+    async def test_load_flushes(self):
+        engine, adapter, queue = await self.get_adapter(max_delay=60)
+        await adapter.add_policy("p", "p", ["alice", "data1", "read"])
+        e = casbin.AsyncEnforcer(get_fixture("rbac_model.conf"), adapter)
+        await e.load_policy()
+        self.assertEqual(e.get_policy(), [["alice", "data1", "read"]])
+
+
+if __name__ == "__main__":
+    unittest.main()